@@ -0,0 +1,183 @@
+"""
+Benchmark of the in-memory metadata index and its caches.
+
+An index is built from synthetic records, so no page is parsed. The
+following is measured:
+
+- the memory used by the index, including its strings (tracemalloc),
+  next to that of the dicts and lists the index replaced;
+- the time to build the index;
+- the time of an incremental update of a single page, including post();
+- the time to save and load the cache, in both formats;
+- the time to append to and replay the journal;
+- the peak RSS of the whole run, most of which is the benchmark input.
+
+Run it from the root of the repository, for example:
+
+  python -m benchmarks.metadata_index --pages 40000
+"""
+
+import click
+import collections
+import random
+import resource
+import tempfile
+import time
+import tracemalloc
+
+from truewiki import metadata
+from truewiki.metadata_index import (
+    RELATIONS,
+    MetadataIndex,
+)
+
+# Of every type of reference, how many a page has, and how many different
+# targets there are in total.
+REFERENCES = {
+    "categories": (3, 500),
+    "files": (1, 5000),
+    "links": (10, None),
+    "templates": (4, 200),
+    "translations": (1, None),
+}
+
+
+def _create_records(pages, references, seed):
+    rng = random.Random(seed)
+    scale = references / sum(count for count, _ in REFERENCES.values())
+
+    records = {}
+    for i in range(pages):
+        record = {
+            "digest": rng.randbytes(32).hex(),
+            "stat": [rng.randrange(1 << 16), rng.randrange(1 << 62), i],
+        }
+        for relation, (count, targets) in REFERENCES.items():
+            count = round(count * scale)
+            if relation == "links":
+                record[relation] = [f":Page:en/Page {rng.randrange(pages)}" for _ in range(count)]
+            elif relation == "translations":
+                record[relation] = [f"en/Page {i}"] * count
+            else:
+                namespace = relation[:-1].capitalize()
+                record[relation] = [f"{namespace}/en/{namespace} {rng.randrange(targets)}" for _ in range(count)]
+        records[f"Page/en/Page {i}"] = record
+    return records
+
+
+def _build(records):
+    index = MetadataIndex()
+    for page, record in records.items():
+        index.set_page(page, record)
+    index.post()
+    return index
+
+
+def _build_baseline(records):
+    """
+    Build the metadata as it was kept before MetadataIndex: a dict per page
+    with a list per relation, and a dict per relation from target to the
+    sorted list of pages referring to it.
+    """
+
+    pages = {}
+    pages_lc = {}
+    reverse_indexes = {relation: collections.defaultdict(list) for relation in RELATIONS}
+    for page, record in records.items():
+        page_data = {relation: [] for relation in RELATIONS}
+        page_data["digest"] = record["digest"]
+        page_data["stat"] = list(record["stat"])
+        for relation in RELATIONS:
+            for target in dict.fromkeys(record[relation]):
+                page_data[relation].append(target)
+                reverse_indexes[relation][target].append(page)
+        pages[page] = page_data
+        pages_lc[page.lower()] = page
+
+    for reverse_index in reverse_indexes.values():
+        for members in reverse_index.values():
+            members.sort()
+    return pages, pages_lc, reverse_indexes
+
+
+def _traced_size(func):
+    tracemalloc.start()
+    result = func()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def _timed(label, func, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    duration = (time.perf_counter() - start) / repeat
+
+    if duration < 0.1:
+        click.echo(f"{label}: {duration * 1000:.2f}ms")
+    else:
+        click.echo(f"{label}: {duration:.2f}s")
+    return result
+
+
+def _load():
+    index = MetadataIndex()
+    assert metadata._load_cache(index)
+    return index
+
+
+@click.command()
+@click.option("--pages", help="Amount of pages in the index.", default=40000, show_default=True)
+@click.option("--references", help="Amount of references per page.", default=19, show_default=True)
+@click.option("--updates", help="Amount of incremental updates to time.", default=1000, show_default=True)
+@click.option("--seed", help="Seed of the synthetic records.", default=0, show_default=True)
+def main(pages, references, updates, seed):
+    click.echo(f"Creating {pages} records ...")
+    records = _create_records(pages, references, seed)
+
+    # Strings of the input are shared with both, so neither counts them;
+    # strings created while building (like lowercase names) do count.
+    size = _traced_size(lambda: _build_baseline(records))
+    click.echo(f"Baseline size, dicts and lists (tracemalloc): {size / 1024 / 1024:.1f} MiB")
+    size = _traced_size(lambda: _build(records))
+    click.echo(f"Index size (tracemalloc): {size / 1024 / 1024:.1f} MiB")
+
+    index = _timed("Building the index", lambda: _build(records))
+
+    # Every update changes the links of a page, like an edit would.
+    rng = random.Random(seed)
+    changes = []
+    for page in rng.choices(list(records), k=updates):
+        record = dict(records[page])
+        record["links"] = [f":Page:en/Page {rng.randrange(pages)}" for _ in record["links"]]
+        changes.append((page, record))
+
+    # Like MetadataQueue.page_changed(), every update is made to a copy.
+    def update():
+        page, record = changes.pop()
+        updated = index.copy()
+        metadata._process_record(updated, page, record)
+        updated.post()
+        return updated
+
+    index = _timed("Incremental update of a page", update, repeat=updates)
+
+    with tempfile.TemporaryDirectory(prefix="truewiki-benchmark") as temp_folder:
+        metadata.CACHE_FILENAME = f"{temp_folder}/.cache_metadata"
+
+        for cache_format in ("binary", "json"):
+            metadata.CACHE_FORMAT = cache_format
+            _timed(f"Saving the {cache_format} cache", lambda: metadata._save_cache(index))
+            _timed(f"Loading the {cache_format} cache", _load)
+
+        _timed("Appending every page to the journal", lambda: metadata._journal_append(index, index.pages()))
+        _timed("Replaying the journal", lambda: metadata._journal_replay(MetadataIndex()))
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    click.echo(f"Peak RSS: {peak_rss / 1024:.0f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark of loading the metadata of a wiki.
+
+A wiki of synthetic pages is written to a temporary folder. Every page
+uses the same template and is in the same category, and links to a few
+other pages. The following is timed:
+
+- a cold load, without a cache; every page is analyzed;
+- a warm load, from the cache written by the cold load; nothing changed;
+- a load after the shared template changed; every page is analyzed
+  again, and removed from and added to the same few reverse indexes.
+
+Run it from the root of the repository, for example:
+
+  python -m benchmarks.metadata_load --pages 30000
+"""
+
+import asyncio
+import click
+import os
+import tempfile
+import time
+
+from truewiki import (
+    config,
+    metadata,
+    singleton,
+)
+from truewiki.namespaces import (  # noqa
+    category,
+    file,
+    folder,
+    page,
+    template,
+    translation,
+)
+from truewiki.storage import local
+
+
+def _write(storage_folder, name, body):
+    filename = f"{storage_folder}/{name}.mediawiki"
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, "w") as fp:
+        fp.write(body)
+
+
+def _create_wiki(storage_folder, pages, links):
+    _write(storage_folder, "Template/en/Shared", "Shared template of page {{{1}}}")
+    _write(storage_folder, "Category/en/Shared", "Every page is in this category.")
+
+    for i in range(pages):
+        body = f"{{{{en/Shared|{i}}}}}\n"
+        body += " ".join(f"[[en/Page {(i + j) % pages}]]" for j in range(1, links + 1))
+        body += "\n[[Category:en/Shared]]\n"
+        _write(storage_folder, f"Page/en/Page {i}", body)
+
+
+async def _timed_load(label):
+    start = time.perf_counter()
+    await metadata.MetadataQueue(None).load_metadata()
+    click.echo(f"{label}: {time.perf_counter() - start:.2f}s")
+
+
+async def _run(storage_folder):
+    await _timed_load("Cold load")
+    await _timed_load("Warm load")
+
+    _write(storage_folder, "Template/en/Shared", "Changed shared template of page {{{1}}}")
+    await _timed_load("Load after changing the shared template")
+
+
+@click.command()
+@click.option("--pages", help="Amount of pages to create.", default=10000, show_default=True)
+@click.option("--links", help="Amount of links per page.", default=5, show_default=True)
+@click.option(
+    "--workers",
+    help="Amount of processes to index pages with. 0 means one per CPU core.",
+    default=0,
+    show_default=True,
+)
+@click.option(
+    "--cache-format",
+    type=click.Choice(["json", "binary"]),
+    default="json",
+    show_default=True,
+)
+def main(pages, links, workers, cache_format):
+    with tempfile.TemporaryDirectory(prefix="truewiki-benchmark") as temp_folder:
+        storage_folder = f"{temp_folder}/data"
+
+        click.echo(f"Creating {pages} pages ...")
+        _create_wiki(storage_folder, pages, links)
+
+        local.STORAGE_FOLDER = storage_folder
+        singleton.STORAGE = local.Storage()
+        config.load()
+
+        metadata.CACHE_FILENAME = f"{temp_folder}/.cache_metadata"
+        metadata.CACHE_FORMAT = cache_format
+        metadata.INDEX_WORKERS = workers
+
+        asyncio.run(_run(storage_folder))
+
+
+if __name__ == "__main__":
+    main()
@@ -49,6 +49,10 @@ async def _run_server(storage):
     os.makedirs("data/Page/de")
     with open("data/Page/de/.keep", "w") as f:
         pass
+    # A language nobody writes a page in during the tests.
+    os.makedirs("data/Page/nl")
+    with open("data/Page/nl/.keep", "w") as f:
+        pass
 
     # Run TrueWiki, with coverage enabled.
     command = ["coverage", "run"]
@@ -0,0 +1,72 @@
+from playwright.sync_api import Page, Playwright, expect
+
+URL = "http://localhost:8080/en/Conditional%20Request"
+
+
+def _get(playwright: Playwright, encoding, if_none_match=None):
+    # A context of its own, so the request is made as an anonymous user.
+    context = playwright.request.new_context()
+    headers = {"Accept-Encoding": encoding}
+    if if_none_match is not None:
+        headers["If-None-Match"] = if_none_match
+
+    try:
+        response = context.get(URL, headers=headers)
+        return response.status, response.headers.get("etag")
+    finally:
+        context.dispose()
+
+
+def test_conditional_create_page(page: Page, login):
+    """Create a page to make conditional requests for."""
+    page.goto(URL)
+
+    create = page.locator("text=Create Page")
+    expect(create).to_be_visible()
+    with page.expect_navigation():
+        create.click()
+
+    page.locator("[name=content]").fill("Conditional content")
+    with page.expect_navigation():
+        page.locator("[name=save]").click()
+    page.wait_for_url(URL)
+
+    expect(page.locator("text=Conditional content")).to_be_visible()
+
+
+def test_conditional_etag_per_encoding(playwright: Playwright):
+    """Every encoding of a page is a representation with its own ETag."""
+    status, etag = _get(playwright, "identity")
+    assert status == 200
+    status, etag_gzip = _get(playwright, "gzip")
+    assert status == 200
+
+    assert etag_gzip == f'{etag[:-1]}-gzip"'
+
+
+def test_conditional_if_none_match(playwright: Playwright):
+    """Only the ETag of the representation being served gives a 304."""
+    _, etag = _get(playwright, "identity")
+    _, etag_gzip = _get(playwright, "gzip")
+
+    assert _get(playwright, "identity", etag)[0] == 304
+    assert _get(playwright, "gzip", etag_gzip)[0] == 304
+    assert _get(playwright, "identity", etag_gzip)[0] == 200
+    assert _get(playwright, "gzip", etag)[0] == 200
+    assert _get(playwright, "identity", '"unknown"')[0] == 200
+
+
+def test_conditional_if_none_match_list(playwright: Playwright):
+    """If-None-Match is a list of weakly compared ETags."""
+    _, etag = _get(playwright, "identity")
+
+    assert _get(playwright, "identity", f'"unknown", {etag}')[0] == 304
+    assert _get(playwright, "identity", f"W/{etag}")[0] == 304
+    assert _get(playwright, "identity", "*")[0] == 304
+
+
+def test_conditional_logged_in(page: Page, login):
+    """Pages are different for every user, so logged in users don't get an ETag."""
+    response = page.request.get(URL, headers={"If-None-Match": "*"})
+    assert response.status == 200
+    assert "etag" not in response.headers
@@ -12,3 +12,10 @@ def test_healtz(page: Page):
     """Make sure the health-check URL is functional."""
     page.goto("http://localhost:8080/healthz")
     expect(page.locator("text=200: OK")).to_be_visible()
+
+
+def test_language_without_pages(page: Page):
+    """Check that a language exists as soon as its folder does."""
+    page.goto("http://localhost:8080/nl/")
+    expect(page.locator("text=There is currently no text on this page.")).to_be_visible()
+    expect(page.locator("text=does not exist")).to_have_count(0)
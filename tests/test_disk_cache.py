@@ -0,0 +1,73 @@
+import os
+
+from truewiki.disk_cache import (
+    DiskCache,
+    write_atomic,
+)
+from truewiki.page_cache import RenderedPage
+
+
+def test_write_atomic(tmp_path):
+    """A file is replaced as a whole, and no temporary file is left behind."""
+    filename = str(tmp_path / "page.html")
+    write_atomic(filename, b"old")
+    write_atomic(filename, b"new")
+
+    with open(filename, "rb") as fp:
+        assert fp.read() == b"new"
+    assert os.listdir(tmp_path) == ["page.html"]
+
+
+def test_generation(tmp_path):
+    """Pages of another generation are not reused."""
+    cache = DiskCache(str(tmp_path / "cache"))
+    assert not cache.set_generation("one")
+    assert cache.set_generation("one")
+    assert not cache.set_generation("two")
+    assert cache.set_generation("two")
+
+
+def test_scan_and_load(tmp_path):
+    """Pages of a previous run are accounted for, next to pages stored while scanning."""
+    cache = DiskCache(str(tmp_path / "cache"))
+    cache.set("Page/en/A", RenderedPage(b"A" * 100))
+    cache.set("Page/en/B", RenderedPage(b"B" * 100))
+    # Without knowing when pages were last used, the oldest is the least recently used.
+    os.utime(cache.filename("Page/en/A"), (1, 1))
+
+    # Room for all but one page.
+    restarted = DiskCache(cache.folder, budget=cache.size // 2 * 3 - 1)
+    pages = restarted.scan()
+    restarted.set("Page/en/C", RenderedPage(b"C" * 100))
+    restarted.load(pages)
+
+    assert len(restarted) == 2
+    assert restarted.size == cache.size
+    assert restarted.get_times(["Page/en/A", "Page/en/B", "Page/en/C"]).keys() == {"Page/en/B", "Page/en/C"}
+
+
+def test_hold(tmp_path):
+    """A held page is only removed from disk once it is released."""
+    cache = DiskCache(str(tmp_path / "cache"))
+    cache.set("Page/en/A", RenderedPage(b"a" * 100))
+    cache.set("Page/en/B", RenderedPage(b"b" * 100))
+    filename_a = cache.filename("Page/en/A")
+    filename_b = cache.filename("Page/en/B")
+
+    cache.hold(filename_a)
+    cache.hold(filename_a)
+    cache.remove("Page/en/A")
+    assert len(cache) == 1
+    cache.release(filename_a)
+    assert os.path.exists(filename_a)
+    cache.release(filename_a)
+    assert not os.path.exists(filename_a)
+    assert not os.path.exists(f"{filename_a}.gz")
+
+    # Stored again while held; the new files stay.
+    cache.hold(filename_b)
+    cache.remove("Page/en/B")
+    cache.set("Page/en/B", RenderedPage(b"c" * 100))
+    cache.release(filename_b)
+    assert os.path.exists(filename_b)
+    assert len(cache) == 1
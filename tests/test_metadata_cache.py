@@ -0,0 +1,96 @@
+import pytest
+import struct
+
+from truewiki import metadata_cache
+from truewiki.metadata_index import (
+    MetadataIndex,
+    RELATIONS,
+)
+
+
+def _page(digest="", stat=(0, 0, 0), **relations):
+    data = {relation: relations.get(relation, []) for relation in RELATIONS}
+    data["digest"] = digest
+    data["stat"] = list(stat)
+    return data
+
+
+def _index():
+    index = MetadataIndex()
+    index.set_page(
+        "Page/en/Main Page",
+        _page("ab" * 32, (12, 1_600_000_000_000_000_000, 42), links=[":Page:en/Other"], templates=["Template/en/Base"]),
+    )
+    index.set_page(
+        "Page/en/Other",
+        _page("cd" * 32, (34, 1_700_000_000_000_000_000, 43), categories=["en/Pages"], translations=["en/Other"]),
+    )
+    index.set_page("Template/en/Base", _page("ef" * 32, (56, 1_800_000_000_000_000_000, 44)))
+    # A removed page leaves strings behind that are no longer used.
+    index.set_page("Page/en/Removed", _page("", links=[":Page:en/Gone"]))
+    index.remove_page("Page/en/Removed")
+    index.post()
+    return index
+
+
+def _round_trip(tmp_path, index):
+    filename = tmp_path / "cache"
+    cache = index.to_binary()
+    cache["version"] = 1
+    metadata_cache.dump(filename, cache)
+
+    assert metadata_cache.is_binary(filename)
+    loaded = metadata_cache.load(filename)
+    assert loaded["version"] == 1
+
+    result = MetadataIndex()
+    result.load_binary(loaded)
+    return result
+
+
+def test_round_trip(tmp_path):
+    """Everything written to the binary cache is read back the same."""
+    index = _index()
+    result = _round_trip(tmp_path, index)
+
+    assert result.to_payload() == index.to_payload()
+    assert result.get_referring("templates", "Template/en/Base") == ["Page/en/Main Page"]
+    assert result.get_stat("Page/en/Other") == [34, 1_700_000_000_000_000_000, 43]
+    assert not result.has_page("Page/en/Removed")
+
+
+def test_round_trip_empty(tmp_path):
+    """An empty index can be written and read back."""
+    result = _round_trip(tmp_path, MetadataIndex())
+    assert len(result) == 0
+
+
+def test_byte_order(tmp_path):
+    """The cache is little-endian, independent of the machine writing it."""
+    filename = tmp_path / "cache"
+    cache = _index().to_binary()
+    cache["version"] = 7
+    metadata_cache.dump(filename, cache)
+
+    data = filename.read_bytes()
+    assert data[:12] == struct.pack("<4sII", metadata_cache.MAGIC, metadata_cache.FORMAT_VERSION, 7)
+    assert data[12:16] == struct.pack("<I", len(cache["strings"]))
+
+
+def test_truncated(tmp_path):
+    """A cache that is cut short is detected as corrupted."""
+    filename = tmp_path / "cache"
+    cache = _index().to_binary()
+    cache["version"] = 1
+    metadata_cache.dump(filename, cache)
+
+    filename.write_bytes(filename.read_bytes()[:-10])
+    with pytest.raises(metadata_cache.CorruptedCacheError):
+        metadata_cache.load(filename)
+
+
+def test_other_format_version(tmp_path):
+    """A cache in another format version is handled as outdated."""
+    filename = tmp_path / "cache"
+    filename.write_bytes(struct.pack("<4sII", metadata_cache.MAGIC, metadata_cache.FORMAT_VERSION + 1, 1))
+    assert metadata_cache.load(filename) == {"version": None}
@@ -0,0 +1,70 @@
+import pytest
+import types
+
+from truewiki import (
+    metadata,
+    singleton,
+)
+from truewiki.metadata_index import (
+    MetadataIndex,
+    RELATIONS,
+)
+
+
+@pytest.fixture
+def changed(monkeypatch):
+    index = MetadataIndex()
+    data = {relation: [] for relation in RELATIONS}
+    data.update(digest="", stat=[0, 0, 0], files=["en/Image.png"])
+    index.set_page("Page/en/Gallery", data)
+    index.post()
+
+    pages = []
+    monkeypatch.setattr(metadata, "INDEX", index)
+    monkeypatch.setattr(metadata, "LAST_INVALIDATED", {})
+    monkeypatch.setattr(metadata, "_scan_languages", lambda: None)
+    monkeypatch.setattr(metadata, "page_changed", pages.extend)
+    return pages
+
+
+def test_only_pages(changed):
+    """Only pages in the indexed folders are analyzed."""
+    metadata.files_changed(
+        [
+            ".truewiki.yml",
+            "README.md",
+            "Page/en/Main Page.mediawiki",
+            "Page/de/.keep",
+            "Template/en/Base.mediawiki",
+            "Other/en/Page.mediawiki",
+        ]
+    )
+    assert changed == ["Page/en/Main Page", "Template/en/Base"]
+
+
+def test_media(changed):
+    """Media is not analyzed, but invalidates the pages showing it."""
+    metadata.files_changed(["File/en/Image.png"])
+    assert changed == []
+    assert set(metadata.LAST_INVALIDATED) == {"File/en/Image.png", "Page/en/Gallery"}
+
+
+def test_media_validators(changed, tmp_path, monkeypatch):
+    """Changing the media of a file changes the ETag of the pages showing it."""
+    monkeypatch.setattr(singleton, "STORAGE", types.SimpleNamespace(folder=str(tmp_path)))
+    monkeypatch.setattr(metadata, "VALIDATORS", {})
+    pages = ("File/en/Image.png", "Page/en/Gallery")
+
+    before = {page: metadata.get_validators(page)[0] for page in pages}
+
+    (tmp_path / "File" / "en").mkdir(parents=True)
+    (tmp_path / "File" / "en" / "Image.png").write_bytes(b"image")
+    metadata.files_changed(["File/en/Image.png"])
+    uploaded = {page: metadata.get_validators(page)[0] for page in pages}
+
+    (tmp_path / "File" / "en" / "Image.png").write_bytes(b"other image")
+    metadata.files_changed(["File/en/Image.png"])
+    replaced = {page: metadata.get_validators(page)[0] for page in pages}
+
+    for page in pages:
+        assert len({before[page], uploaded[page], replaced[page]}) == 3
@@ -0,0 +1,63 @@
+from truewiki import metadata
+from truewiki.metadata_index import (
+    MetadataIndex,
+    RELATIONS,
+)
+
+
+def _page(digest, stat=(1, 2, 3), **relations):
+    data = {relation: relations.get(relation, []) for relation in RELATIONS}
+    data["digest"] = digest
+    data["stat"] = list(stat)
+    return data
+
+
+def test_copy():
+    """Changes to a copy of the index are not visible in the original."""
+    index = MetadataIndex()
+    index.set_page("Page/en/A", _page("aa" * 32, categories=["en/Cat"]))
+    index.set_page("Page/en/B", _page("bb" * 32, categories=["en/Cat"]))
+    index.post()
+    payload = index.to_payload()
+
+    copy = index.copy()
+    copy.set_page("Page/en/A", _page("cc" * 32, categories=["en/Other"]))
+    copy.remove_page("Page/en/B")
+    copy.set_page("Page/en/C", _page("dd" * 32, categories=["en/Cat"]))
+    copy.post()
+    copy.set_stat("Page/en/C", [4, 5, 6])
+
+    assert index.to_payload() == payload
+    assert index.get_referring("categories", "en/Cat") == ["Page/en/A", "Page/en/B"]
+    assert index.get_correct_case("page/en/b") == "Page/en/B"
+    assert not index.has_page("Page/en/C")
+
+    assert copy.get_referring("categories", "en/Cat") == ["Page/en/C"]
+    assert copy.get_referring("categories", "en/Other") == ["Page/en/A"]
+    assert copy.get_correct_case("page/en/b") == "page/en/b"
+    assert copy.get_stat("Page/en/C") == [4, 5, 6]
+
+
+def test_set_stat_shared_record():
+    """Changing the stat in a copy doesn't change the record of the original."""
+    index = MetadataIndex()
+    index.set_page("Page/en/A", _page("aa" * 32))
+    index.post()
+
+    copy = index.copy()
+    copy.set_stat("Page/en/A", [7, 8, 9])
+
+    assert index.get_stat("Page/en/A") == [1, 2, 3]
+    assert copy.get_stat("Page/en/A") == [7, 8, 9]
+    assert copy.get_digest("Page/en/A") == "aa" * 32
+
+
+def test_use_index(monkeypatch):
+    """A thread keeps using its index, also when INDEX is replaced."""
+    index = MetadataIndex()
+    monkeypatch.setattr(metadata, "INDEX", MetadataIndex())
+
+    with metadata.use_index(index):
+        monkeypatch.setattr(metadata, "INDEX", MetadataIndex())
+        assert metadata.get_index() is index
+    assert metadata.get_index() is metadata.INDEX
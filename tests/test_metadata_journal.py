@@ -0,0 +1,163 @@
+import os
+import pytest
+
+from truewiki import metadata
+from truewiki.disk_cache import DiskCache
+from truewiki.metadata_index import (
+    MetadataIndex,
+    RELATIONS,
+)
+from truewiki.page_cache import RenderedPage
+
+
+def _page(digest, **relations):
+    data = {relation: relations.get(relation, []) for relation in RELATIONS}
+    data["digest"] = digest
+    data["stat"] = [len(digest), 1_600_000_000_000_000_000, 1]
+    return data
+
+
+@pytest.fixture(params=["json", "binary"])
+def cache(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(metadata, "CACHE_FILENAME", str(tmp_path / ".cache_metadata"))
+    monkeypatch.setattr(metadata, "CACHE_FORMAT", request.param)
+    monkeypatch.setattr(metadata, "JOURNAL_ENTRIES", 0)
+
+
+def _load():
+    index = MetadataIndex()
+    assert metadata._load_cache(index)
+    if os.path.exists(metadata._journal_filename()):
+        metadata._journal_replay(index)
+    index.post()
+    return index
+
+
+def test_journal_replay(cache):
+    """Changes after the cache was written are replayed from the journal."""
+    index = MetadataIndex()
+    metadata._process_record(index, "Page/en/A", _page("aa" * 32, categories=["en/Old"]))
+    metadata._process_record(index, "Page/en/B", _page("bb" * 32, links=[":Page:en/A"]))
+    metadata._process_record(index, "Page/en/C", _page("cc" * 32))
+    index.post()
+    metadata._save_cache(index)
+
+    # A changed page, a removed page and a new page.
+    metadata._process_record(index, "Page/en/A", _page("dd" * 32, categories=["en/New"]))
+    metadata._process_record(index, "Page/en/C", None)
+    metadata._process_record(index, "Page/en/D", _page("ee" * 32, templates=["Template/en/T"]))
+    index.post()
+    metadata._journal_append(index, ["Page/en/A", "Page/en/C", "Page/en/D"])
+
+    result = _load()
+    assert result.to_payload() == index.to_payload()
+    assert result.get_referring("categories", "en/New") == ["Page/en/A"]
+    assert result.get_referring("categories", "en/Old") == []
+    assert not result.has_page("Page/en/C")
+
+
+def test_journal_corrupted(cache):
+    """A journal entry that was not written completely, is ignored."""
+    index = MetadataIndex()
+    metadata._process_record(index, "Page/en/A", _page("aa" * 32))
+    index.post()
+    metadata._save_cache(index)
+
+    metadata._process_record(index, "Page/en/B", _page("bb" * 32))
+    index.post()
+    metadata._journal_append(index, ["Page/en/B"])
+    with open(metadata._journal_filename(), "a") as fp:
+        fp.write('{"page": "Page/en/C", "da')
+
+    result = _load()
+    assert result.pages() == ["Page/en/A", "Page/en/B"]
+    assert metadata.JOURNAL_ENTRIES == 1
+
+
+def test_journal_append_after_corrupted(cache):
+    """Entries appended after an incomplete entry (after a restart) are replayed."""
+    index = MetadataIndex()
+    metadata._process_record(index, "Page/en/A", _page("aa" * 32))
+    index.post()
+    metadata._save_cache(index)
+
+    metadata._process_record(index, "Page/en/B", _page("bb" * 32))
+    index.post()
+    metadata._journal_append(index, ["Page/en/B"])
+    with open(metadata._journal_filename(), "a") as fp:
+        fp.write('{"page": "Page/en/C", "da')
+
+    metadata._process_record(index, "Page/en/D", _page("dd" * 32))
+    metadata._process_record(index, "Page/en/A", None)
+    index.post()
+    metadata._journal_append(index, ["Page/en/A", "Page/en/D"])
+    metadata._process_record(index, "Page/en/E", _page("ee" * 32))
+    index.post()
+    metadata._journal_append(index, ["Page/en/E"])
+
+    result = _load()
+    assert result.pages() == ["Page/en/B", "Page/en/D", "Page/en/E"]
+    assert metadata.JOURNAL_ENTRIES == 4
+
+
+def test_save_removes_journal(cache):
+    """Everything in the journal is part of the cache once it is written."""
+    index = MetadataIndex()
+    metadata._process_record(index, "Page/en/A", _page("aa" * 32))
+    index.post()
+    metadata._journal_append(index, ["Page/en/A"])
+
+    metadata._save_cache(index)
+    assert metadata.JOURNAL_ENTRIES == 0
+    assert _load().pages() == ["Page/en/A"]
+
+
+def test_last_modified_after_restart(cache, monkeypatch):
+    """A page is not older than the last change in the journal, even if that change was to another page."""
+    monkeypatch.setattr(metadata, "INDEX", MetadataIndex())
+    monkeypatch.setattr(metadata, "VALIDATORS", {})
+    monkeypatch.setattr(metadata, "LAST_INVALIDATED", {})
+    monkeypatch.setattr(metadata, "LAST_INVALIDATED_ALL", 0.0)
+    monkeypatch.setattr(metadata, "_scan_languages", lambda: None)
+
+    index = MetadataIndex()
+    metadata._process_record(index, "Page/en/A", _page("aa" * 32, links=[":Page:en/B"]))
+    index.post()
+    metadata._save_cache(index)
+    os.utime(metadata.CACHE_FILENAME, (1_600_000_000, 1_600_000_000))
+
+    # Creating the page A links to, changes how A renders.
+    metadata._process_record(index, "Page/en/B", _page("bb" * 32))
+    index.post()
+    metadata._journal_append(index, ["Page/en/B"])
+    os.utime(metadata._journal_filename(), (1_700_000_000, 1_700_000_000))
+
+    assert metadata.load_stale_metadata() == 1_700_000_000
+    _, last_modified = metadata.get_validators("Page/en/A")
+    assert last_modified == 1_700_000_000
+
+
+def test_replay_keeps_rendered_pages(cache, tmp_path, monkeypatch):
+    """Replaying the journal at startup doesn't remove pages rendered by the previous run."""
+    monkeypatch.setattr(metadata, "INDEX", MetadataIndex())
+    monkeypatch.setattr(metadata, "LAST_INVALIDATED", {})
+    monkeypatch.setattr(metadata, "RENDERED_FILES", DiskCache(str(tmp_path / "pages")))
+    monkeypatch.setattr(metadata, "_scan_languages", lambda: None)
+
+    index = MetadataIndex()
+    metadata._process_record(index, "Page/en/A", _page("aa" * 32, categories=["en/Cat"]))
+    index.post()
+    metadata._save_cache(index)
+
+    metadata._process_record(index, "Page/en/A", _page("bb" * 32, categories=["en/Cat"]))
+    index.post()
+    metadata._journal_append(index, ["Page/en/A"])
+    for page in ("Page/en/A", "Category/en/Cat"):
+        metadata.RENDERED_FILES.set(page, RenderedPage(page.encode()))
+
+    # Restart.
+    metadata.LAST_INVALIDATED.clear()
+    metadata.load_stale_metadata()
+    assert metadata.LAST_INVALIDATED == {}
+    for page in ("Page/en/A", "Category/en/Cat"):
+        assert metadata.RENDERED_FILES.get_time(page) is not None
@@ -0,0 +1,45 @@
+import datetime
+
+from truewiki.views.page import (
+    _is_not_modified,
+    _variant_etag,
+)
+
+LAST_MODIFIED = 1_600_000_000
+BEFORE = datetime.datetime.fromtimestamp(LAST_MODIFIED - 1, datetime.timezone.utc)
+AFTER = datetime.datetime.fromtimestamp(LAST_MODIFIED, datetime.timezone.utc)
+
+
+def test_variant_etag():
+    """Every encoding has its own ETag."""
+    assert _variant_etag("abc", "identity") == "abc"
+    assert _variant_etag("abc", "gzip") == "abc-gzip"
+    assert _variant_etag("abc", "deflate") == "abc-deflate"
+
+
+def test_if_none_match():
+    """Only the full ETag of the representation matches."""
+    assert _is_not_modified(None, "abc-gzip", LAST_MODIFIED, ("abc-gzip",), None)
+    assert _is_not_modified(None, "abc", LAST_MODIFIED, ("other", "abc"), None)
+    assert _is_not_modified(None, "abc", LAST_MODIFIED, ("*",), None)
+    assert not _is_not_modified(None, "abc", LAST_MODIFIED, ("abc-gzip",), None)
+    assert not _is_not_modified(None, "abc-gzip", LAST_MODIFIED, ("abc",), None)
+    assert not _is_not_modified(None, "abc-gzip", LAST_MODIFIED, ("abc-deflate",), None)
+
+
+def test_if_none_match_precedence():
+    """If-None-Match takes precedence over If-Modified-Since."""
+    assert not _is_not_modified(None, "abc", LAST_MODIFIED, ("other",), AFTER)
+
+
+def test_if_none_match_user():
+    """Users don't get an ETag, so If-None-Match never matches."""
+    assert not _is_not_modified("user", "abc", LAST_MODIFIED, ("abc",), None)
+    assert not _is_not_modified("user", "abc", LAST_MODIFIED, ("*",), AFTER)
+
+
+def test_if_modified_since():
+    assert _is_not_modified(None, "abc", LAST_MODIFIED, None, AFTER)
+    assert _is_not_modified("user", "abc", LAST_MODIFIED, None, AFTER)
+    assert not _is_not_modified(None, "abc", LAST_MODIFIED, None, BEFORE)
+    assert not _is_not_modified(None, "abc", LAST_MODIFIED, None, None)
@@ -0,0 +1,38 @@
+import sys
+import wikitextparser
+
+from concurrent import futures
+from wikitexthtml.render import parser_function
+
+from truewiki.views import page
+
+
+class _Instance:
+    def add_error(self, error):
+        raise AssertionError(error)
+
+
+def _render(i):
+    wtp = wikitextparser.parse(f"{{{{#expr: ({i} + 1) * 2 - {i} / 2}}}} {{{{#ifexpr: {i} > 50 | big | small}}}}")
+    parser_function.replace(_Instance(), wtp)
+    return wtp.string
+
+
+def test_expressions_in_threads(monkeypatch):
+    """Expressions evaluated by renders in several threads don't mix."""
+    for name in ("#expr", "#ifexpr"):
+        monkeypatch.setitem(parser_function.PARSER_FUNCTIONS, name, parser_function.PARSER_FUNCTIONS[name])
+    page._serialize_expressions()
+
+    expected = {i: _render(i) for i in range(100)}
+
+    # Switch threads as often as possible, to make them meet inside the parser.
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        with futures.ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(_render, [i % 100 for i in range(2000)]))
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    assert results == [expected[i % 100] for i in range(2000)]
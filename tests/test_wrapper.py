@@ -0,0 +1,158 @@
+import glob
+import os
+import pytest
+
+from truewiki import wrapper
+from truewiki.wiki_page import WikiPage
+
+# Registers the namespaces, like __main__ does.
+import truewiki.namespaces.category  # noqa
+import truewiki.namespaces.file  # noqa
+import truewiki.namespaces.folder  # noqa
+import truewiki.namespaces.page  # noqa
+import truewiki.namespaces.template  # noqa
+import truewiki.namespaces.translation  # noqa
+
+TEMPLATE_FOLDER = os.path.join(os.path.dirname(__file__), "..", wrapper.TEMPLATE_FOLDER)
+
+VARIABLES = {
+    "css": "<style>body { color: black; }</style>",
+    "display_name": "Some User",
+    "does_exist": "1",
+    "errors": "2",
+    "favicon": "/favicon.ico",
+    "has_search": "",
+    "has_source": "1",
+    "history_url": "https://example.com/history?page=Page/en/Main%20Page.mediawiki",
+    "html_footer": "",
+    "html_header": "<b>Header</b>",
+    "language": "en",
+    "license": "Licensed under <a href='/License'>CC-BY-SA</a>",
+    "project_name": "Wiki & Co",
+    "repository_url": "",
+}
+TEMPLATES = {
+    "breadcrumbs": "<li>Breadcrumbs</li>",
+    "content": "<p>Content</p>",
+    "footer": "<p>Footer</p>",
+    "language": "<div>Languages</div>",
+}
+
+
+def _compare(body, variables, page="en/Main Page"):
+    template = wrapper.CompiledTemplate(None, body)
+    wiki_page = WikiPage(page)
+
+    expected = wrapper._render_wikitext(
+        wiki_page, body, {name: str(value) for name, value in variables.items()}, TEMPLATES
+    )
+    assert template.render(WikiPage(page), dict(variables), TEMPLATES) == expected
+    return template
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        "plain text",
+        "{{{project_name}}} {{{missing}}} {{{missing|default}}} {{{missing|{{{project_name}}}}}}",
+        "{{#if: {{{has_source|}}}|yes|no}} {{#if: {{{has_search|}}}|yes|no}} {{#if: {{{missing|}}}|yes}}",
+        "{{#if: {{{errors|}}}|\n    <span>{{{errors}}}</span>\n}}",
+        "{{#if: {{{does_exist|}}}|{{#if: {{{display_name|}}}|Edit|Login}}|Create}}",
+        '<a href="/edit/{{urlencode:{{FULLPAGENAME}}}}">{{PAGENAME}}</a> {{BASEPAGENAME}} {{NAMESPACE}}',
+        "{{SUBPAGENAME}} {{CURRENTYEAR}}",
+        "<ul>{{breadcrumbs}}</ul>{{content}}{{unknown}}",
+        "{{#if: {{{has_source|}}}|{{content}}|{{footer}}}}",
+    ],
+)
+def test_compiled(body):
+    """A compiled template renders the same as the wikitext."""
+    template = _compare(body, VARIABLES)
+    assert template.parts is not None
+
+
+@pytest.mark.parametrize("page", ["en/Main Page", "en/Sub/Page", "Template/en/Base", "Category/en/Pages"])
+def test_compiled_pages(page):
+    """Page variables render the same as the wikitext."""
+    body = "{{FULLPAGENAME}}|{{PAGENAME}}|{{BASEPAGENAME}}|{{SUBPAGENAME}}|{{urlencode:{{FULLPAGENAME}}}}"
+    template = _compare(body, VARIABLES, page=page)
+    assert template.parts is not None
+
+
+@pytest.mark.parametrize("filename", glob.glob(f"{TEMPLATE_FOLDER}/**/*.mediawiki", recursive=True))
+def test_wrapper_templates(filename):
+    """The templates that ship with TrueWiki render the same as the wikitext."""
+    with open(filename) as fp:
+        body = fp.read()
+
+    template = _compare(body, VARIABLES)
+    # Only the language snippet has a wikilink; it is not used as wrapper.
+    assert (template.parts is None) == ("[[" in body)
+    _compare(body, {})
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        "<nowiki>{{{project_name}}}</nowiki>",
+        "<pre>{{{project_name}}}</pre>",
+        "[[Main Page|{{{project_name}}}]]",
+        "{{lc:{{{project_name}}}}}",
+        "{{#ifeq: {{{language}}}|en|English|Other}}",
+        "{{#if: {{{language}}}|{{content}}}} {{urlencode:{{content}}}}",
+        "{{breadcrumbs|with argument}}",
+    ],
+)
+def test_unsupported(body):
+    """Templates that cannot be compiled are rendered as wikitext."""
+    template = _compare(body, VARIABLES)
+    assert template.parts is None
+
+
+@pytest.mark.parametrize(
+    "variables",
+    [
+        {"project_name": "{{content}}"},
+        {"project_name": "}}"},
+        {"project_name": "{"},
+        {"project_name": "["},
+        {"language": "en|fr"},
+        {"language": "[fr]"},
+    ],
+)
+def test_unsafe_values(variables):
+    """Values that could change how the template parses are rendered as wikitext."""
+    body = "<title>{{{project_name}}}</title> {{#if: {{{language|}}}|<a href='/{{{language}}}'>|none}} {{content}}"
+    template = _compare(body, variables)
+    assert template.parts is not None
+    assert not template._can_substitute(variables)
+
+
+def test_safe_values():
+    """Outside parser functions, values can contain characters that are special inside them."""
+    body = "<title>{{{project_name}}}</title> {{#if: {{{language|}}}|{{{language}}}|none}}"
+    variables = {"project_name": "A | B [C]", "language": "en"}
+    template = _compare(body, variables)
+    assert template._can_substitute(variables)
+
+
+def test_load_templates(tmp_path, monkeypatch):
+    """Changes on disk are only picked up when the templates are loaded again."""
+    monkeypatch.setattr(wrapper, "TEMPLATE_FOLDER", str(tmp_path))
+    monkeypatch.setattr(wrapper, "_TEMPLATES", {})
+
+    filename = tmp_path / "Page.mediawiki"
+    filename.write_text("old")
+    assert wrapper.load_templates()
+    assert wrapper.get_template("Page").body == "old"
+    assert not wrapper.load_templates()
+    generation = wrapper.get_generation()
+
+    filename.write_text("new body")
+    assert wrapper.get_template("Page").body == "old"
+    assert wrapper.load_templates()
+    assert wrapper.get_template("Page").body == "new body"
+    assert wrapper.get_generation() != generation
+
+    filename.unlink()
+    assert wrapper.load_templates()
+    assert wrapper.get_generation()[1] == 0
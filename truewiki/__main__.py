@@ -14,8 +14,10 @@ from openttd_helpers.sentry_helper import click_sentry
 
 from . import (
     config,
+    metadata,
     singleton,
     validate,
+    wrapper,
 )
 from .metadata import click_metadata
 from .storage.git import click_storage_git
@@ -32,7 +34,12 @@ from .user_session import (
     remove_session_cookie,
     SESSION_COOKIE_NAME,
 )
-from .views.page import click_page
+from .views.page import (
+    click_page,
+    load_rendered_pages,
+    on_response_prepare as page_on_response_prepare,
+    start_prerender,
+)
 from .web_routes import (
     click_web_routes,
     routes,
@@ -121,6 +128,16 @@ async def wait_for_storage():
     await singleton.STORAGE.wait_for_ready()
 
 
+async def wait_for_storage_in_background():
+    await wait_for_storage()
+
+    # Storage might have changed since the configuration was loaded.
+    generation = config.GENERATION
+    config.load()
+    if config.GENERATION != generation:
+        metadata.config_changed()
+
+
 @click_helper.command()
 @click_logging  # Should always be on top, as it initializes the logging
 @click_sentry
@@ -159,9 +176,25 @@ async def wait_for_storage():
 @click_user_gitlab
 @click_user_microsoft
 @click_page
+@click.option(
+    "--serve-stale-on-startup",
+    help="Start serving right away from the caches of the previous run, while validating them against storage in the "
+    "background. /readyz reports when this is done.",
+    is_flag=True,
+)
 @click.option("--validate-all", help="Validate all mediawiki files and report all errors", is_flag=True)
 @click.option("--validate-output-json", help="Report validation result as JSON", is_flag=True)
-def main(bind, port, storage, frontend_url, cache_time, remote_ip_header, validate_all, validate_output_json):
+def main(
+    bind,
+    port,
+    storage,
+    frontend_url,
+    cache_time,
+    remote_ip_header,
+    serve_stale_on_startup,
+    validate_all,
+    validate_output_json,
+):
     if frontend_url and frontend_url.endswith("/"):
         frontend_url = frontend_url[:-1]
     singleton.FRONTEND_URL = frontend_url
@@ -173,11 +206,29 @@ def main(bind, port, storage, frontend_url, cache_time, remote_ip_header, valida
     instance.prepare()
     instance.reload()
 
-    # At startup, ensure storage is loaded in.
     loop = asyncio.get_event_loop()
-    loop.run_until_complete(wait_for_storage())
 
-    config.load()
+    cache_time = None
+    if serve_stale_on_startup and not validate_all:
+        # Use storage as it is on disk, and the metadata of the previous run.
+        config.load()
+        cache_time = metadata.load_stale_metadata()
+
+    if cache_time is None:
+        # At startup, ensure storage is loaded in.
+        loop.run_until_complete(wait_for_storage())
+
+        config.load()
+    else:
+        task = loop.create_task(wait_for_storage_in_background())
+        task.add_done_callback(metadata.check_for_exception)
+
+    # Rendered pages depend on the wrapper templates too; see
+    # metadata.get_generation().
+    wrapper.load_templates()
+
+    task = loop.create_task(load_rendered_pages(cache_time))
+    task.add_done_callback(metadata.check_for_exception)
 
     if validate_all:
         log.info("Validating all mediawiki files ..")
@@ -189,8 +240,11 @@ def main(bind, port, storage, frontend_url, cache_time, remote_ip_header, valida
             print(json.dumps(errors, indent=4))
         return
 
+    start_prerender()
+
     webapp = web.Application(client_max_size=MAX_UPLOAD_SIZE, middlewares=[remove_cookie_middleware])
     webapp.on_response_prepare.append(cache_on_prepare)
+    webapp.on_response_prepare.append(page_on_response_prepare)
     if remote_ip_header:
         global REMOTE_IP_HEADER
         REMOTE_IP_HEADER = remote_ip_header.upper()
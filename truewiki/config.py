@@ -1,3 +1,8 @@
+import glob
+import hashlib
+import json
+import os
+import wikitexthtml
 import yaml
 
 from . import singleton
@@ -15,12 +20,22 @@ LICENSE = "Unlicensed"
 PRIMARY_LANGUAGE = "en"
 PROJECT_NAME = "Unnamed"
 
+# Digest and modification time of the configuration and the code. Wrapper
+# templates are not part of it; they are tracked by the wrapper itself.
+GENERATION = ""
+GENERATION_TIME = 0
 
-def load():
+
+def load(generation=None):
+    """
+    Load the configuration from storage. The generation (as GENERATION,
+    GENERATION_TIME) can be given if it is already known, like by the
+    index workers, as computing it means reading all the code.
+    """
     global CSS, FAVICON, JAVASCRIPT, LICENSE, PRIMARY_LANGUAGE, PROJECT_NAME
 
     if not singleton.STORAGE.file_exists(".truewiki.yml"):
-        post_load()
+        post_load(generation)
         return
 
     config = yaml.safe_load(singleton.STORAGE.file_read(".truewiki.yml"))
@@ -34,9 +49,36 @@ def load():
     PRIMARY_LANGUAGE = config.get("primary-language", PRIMARY_LANGUAGE)
     PROJECT_NAME = config.get("project-name", PROJECT_NAME)
 
-    post_load()
+    post_load(generation)
+
+
+def _generation():
+    digest = hashlib.sha256()
+    digest.update(
+        json.dumps([CSS, FAVICON, HTML_SNIPPETS, JAVASCRIPT, LICENSE, PRIMARY_LANGUAGE, PROJECT_NAME]).encode()
+    )
+
+    filenames = [f"{singleton.STORAGE.folder}/.truewiki.yml"]
+    # The code only changes with a new deployment.
+    for folder in (os.path.dirname(__file__), os.path.dirname(wikitexthtml.__file__)):
+        filenames.extend(sorted(glob.glob(f"{folder}/**/*.py", recursive=True)))
+
+    generation_time = 0
+    for filename in filenames:
+        if not os.path.exists(filename):
+            continue
 
+        with open(filename, "rb") as fp:
+            digest.update(fp.read())
+            generation_time = max(generation_time, os.fstat(fp.fileno()).st_mtime)
+
+    return digest.hexdigest(), generation_time
+
+
+def post_load(generation=None):
+    global GENERATION, GENERATION_TIME
 
-def post_load():
     HTML_SNIPPETS["css"] = "\n".join([f'<link rel="stylesheet" href="{css}" type="text/css" />' for css in CSS])
     HTML_SNIPPETS["javascript"] = "\n".join([f'<script src="{javascript}"></script>' for javascript in JAVASCRIPT])
+
+    GENERATION, GENERATION_TIME = generation or _generation()
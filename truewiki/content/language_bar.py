@@ -3,7 +3,10 @@ import wikitextparser
 
 from wikitexthtml.render import wikilink
 
-from .. import metadata
+from .. import (
+    metadata,
+    wrapper,
+)
 from ..wiki_page import (
     NAMESPACE_MAPPING,
     WikiPage,
@@ -14,11 +17,10 @@ def create(instance: WikiPage, page: str):
     if not instance.en_page:
         return ""
 
-    with open("templates/snippet/Language.mediawiki", "r") as fp:
-        body = fp.read()
+    body = wrapper.get_template("snippet/Language").body
 
     language_content = ""
-    for url in metadata.TRANSLATIONS.get(instance.en_page, []):
+    for url in metadata.get_index().get_referring("translations", instance.en_page):
         if not url.startswith(tuple(NAMESPACE_MAPPING.keys())):
             raise RuntimeError(f"{url} has unknown namespace")
 
@@ -0,0 +1,310 @@
+"""
+On-disk cache of rendered pages.
+
+Pages are stored under the SHA-256 of their key, spread over 256 shards
+(subfolders named after the first two hex digits), so no folder grows too
+big and no page name ends up in a path. Next to every page a gzip variant
+of it is stored. Both are written to a temporary file first, and renamed
+in place after; a reader sees either the old or the new file, never a
+half-written one.
+
+When the total size of all pages exceeds the budget, the least recently
+used pages are removed till it fits again. As filenames can't be turned
+back into keys, the bookkeeping is done by digest. A page that is held
+(see hold()), for example because it is about to be sent, is only
+removed from disk once it is released.
+
+A marker file records the generation (see metadata.get_generation()) of
+the pages; pages of another generation are never reused after a restart.
+"""
+
+import collections
+import hashlib
+import logging
+import os
+import tempfile
+import time
+
+log = logging.getLogger(__name__)
+
+_SUFFIXES = (".html", ".html.gz")
+# Temporary files older than this (in seconds) are left behind by a write
+# that never finished.
+_TEMPORARY_MAX_AGE = 60
+
+
+def write_atomic(filename, data: bytes):
+    """Write a file by renaming a temporary file in place."""
+
+    # Every write gets its own temporary file, so two writes of the same
+    # file (like from two renders of a page) can't mix.
+    fd, temp_filename = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(filename))
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(data)
+        # mkstemp() only allows the owner to read the file.
+        os.chmod(temp_filename, 0o644)
+        os.replace(temp_filename, filename)
+    except BaseException:
+        _remove(temp_filename)
+        raise
+
+
+def _size(filename):
+    try:
+        return os.path.getsize(filename)
+    except FileNotFoundError:
+        return 0
+
+
+def _remove(filename):
+    try:
+        os.unlink(filename)
+    except FileNotFoundError:
+        pass
+
+
+class DiskCache:
+    def __init__(self, folder=None, budget=0):
+        self.folder = folder
+        # Maximum total size of all pages in bytes; 0 means no limit.
+        self.budget = budget
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # Total size of the files of a page, by digest.
+        self._pages = collections.OrderedDict()
+        # How often a page is held, and which of those are removed since.
+        self._held = collections.Counter()
+        self._removed = set()
+
+    def __len__(self):
+        return len(self._pages)
+
+    @staticmethod
+    def _digest(key):
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def _filename(self, digest, suffix=".html"):
+        return f"{self.folder}/{digest[:2]}/{digest}{suffix}"
+
+    def filename(self, key):
+        return self._filename(self._digest(key))
+
+    @staticmethod
+    def _digest_of_filename(filename):
+        return os.path.basename(filename).partition(".")[0]
+
+    def hold(self, filename):
+        """
+        Keep the files of a page (as returned by get()) on disk, even if the
+        page is removed, till it is released again.
+        """
+
+        self._held[self._digest_of_filename(filename)] += 1
+
+    def release(self, filename):
+        digest = self._digest_of_filename(filename)
+
+        self._held[digest] -= 1
+        if self._held[digest]:
+            return
+        del self._held[digest]
+
+        if digest in self._removed:
+            self._removed.remove(digest)
+            self._remove_files(digest)
+
+    def set_generation(self, generation):
+        """
+        Mark the pages stored from now on as of the given generation.
+        Returns whether the pages stored by a previous run are of the same
+        generation.
+        """
+
+        filename = f"{self.folder}/generation"
+        try:
+            with open(filename) as fp:
+                previous = fp.read()
+        except FileNotFoundError:
+            previous = None
+
+        if previous != generation:
+            os.makedirs(self.folder, exist_ok=True)
+            write_atomic(filename, generation.encode())
+        return previous == generation
+
+    def scan(self):
+        """
+        Find the pages stored by a previous run, as a list of (mtime,
+        digest, size). Only touches the disk, so it can run in a thread;
+        the result is passed to load().
+        """
+
+        if not self.folder or not os.path.isdir(self.folder):
+            return []
+
+        temporary_before = time.time() - _TEMPORARY_MAX_AGE
+
+        pages = []
+        for shard in os.scandir(self.folder):
+            if len(shard.name) != 2 or not shard.is_dir():
+                continue
+
+            sizes = collections.defaultdict(int)
+            mtimes = {}
+            for entry in os.scandir(shard.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # Removed while we were scanning.
+                    continue
+
+                if entry.name.endswith(".tmp"):
+                    if stat.st_mtime < temporary_before:
+                        _remove(entry.path)
+                    continue
+
+                digest, _, suffix = entry.name.partition(".")
+                if f".{suffix}" not in _SUFFIXES:
+                    continue
+
+                sizes[digest] += stat.st_size
+                if suffix == "html":
+                    mtimes[digest] = stat.st_mtime
+
+            for digest, size in sizes.items():
+                pages.append((mtimes.get(digest, 0), digest, size))
+        return pages
+
+    def load(self, pages):
+        """Account for the pages found by scan()."""
+
+        # Without knowing when pages were last used, the oldest are
+        # considered the least recently used; pages stored while scanning
+        # are more recent than any of them.
+        for _, digest, size in sorted(pages, reverse=True):
+            if digest in self._pages:
+                continue
+
+            self._pages[digest] = size
+            self._pages.move_to_end(digest, last=False)
+            self.size += size
+        self._evict()
+
+        log.info(f"Found {len(self._pages)} rendered pages on disk, in {self.size / 1024 / 1024:.1f} MiB")
+
+    def get(self, key, not_before):
+        """
+        Return the filename of a page, if it was stored at or after
+        not_before; otherwise None.
+        """
+
+        digest = self._digest(key)
+        filename = self._filename(digest)
+
+        try:
+            mtime = os.path.getmtime(filename)
+        except FileNotFoundError:
+            mtime = None
+
+        if mtime is None or mtime < not_before:
+            self.misses += 1
+            return None
+
+        if digest in self._pages:
+            self._pages.move_to_end(digest)
+        self.hits += 1
+        return filename
+
+    def get_time(self, key):
+        """Return when a page was stored, or None if it isn't."""
+
+        try:
+            return os.path.getmtime(self.filename(key))
+        except FileNotFoundError:
+            return None
+
+    def get_times(self, keys):
+        """
+        Return when every stored page of the given keys was stored. Only
+        touches the disk, so it can run in a thread.
+        """
+
+        times = {}
+        for key in keys:
+            page_time = self.get_time(key)
+            if page_time is not None:
+                times[key] = page_time
+        return times
+
+    def set(self, key, rendered):
+        """Store a page; returns when it was stored."""
+
+        digest = self._digest(key)
+        filename = self._filename(digest)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        # The page is written first; a reader only uses the gzip variant if
+        # it is not older than the page.
+        write_atomic(filename, rendered.body)
+        write_atomic(f"{filename}.gz", rendered.get_body("gzip"))
+        page_time = os.path.getmtime(filename)
+
+        self.size -= self._pages.pop(digest, 0)
+        self._removed.discard(digest)
+        size = _size(filename) + _size(f"{filename}.gz")
+        self._pages[digest] = size
+        self.size += size
+        self._evict()
+
+        return page_time
+
+    def _remove_files(self, digest):
+        for suffix in _SUFFIXES:
+            _remove(self._filename(digest, suffix))
+
+    def _remove_digest(self, digest):
+        if digest in self._held:
+            self._removed.add(digest)
+        else:
+            self._remove_files(digest)
+
+        self.size -= self._pages.pop(digest, 0)
+
+    def remove(self, key):
+        if not self.folder:
+            return
+        self._remove_digest(self._digest(key))
+
+    def retain(self, keys):
+        """Remove all pages, except those with one of the given keys."""
+
+        if not self.folder:
+            return
+
+        digests = {self._digest(key) for key in keys}
+        for digest in [digest for digest in self._pages if digest not in digests]:
+            self._remove_digest(digest)
+
+    def _evict(self):
+        if not self.budget:
+            return
+
+        while self.size > self.budget and self._pages:
+            digest = next(iter(self._pages))
+            self._remove_digest(digest)
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "pages": len(self._pages),
+            "bytes": self.size,
+            "budget": self.budget,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
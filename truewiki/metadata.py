@@ -1,175 +1,398 @@
 import asyncio
 import click
-import glob
+import collections
+import contextlib
 import hashlib
+import io
 import json
 import logging
+import math
+import multiprocessing
 import os
 import sys
+import threading
 import time
 
-from collections import defaultdict
+from concurrent import futures
 from openttd_helpers import click_helper
 
 from . import (
     config,
+    metadata_cache,
     singleton,
+    wrapper,
 )
+from .disk_cache import DiskCache
+from .metadata_index import MetadataIndex
+from .page_cache import PageCache
 from .views import sitemap
+from .walker import (
+    walk_folders,
+    walk_pages,
+)
 from .wiki_page import WikiPage
 
 log = logging.getLogger(__name__)
 
 CACHE_FILENAME = ".cache_metadata.json"
-CACHE_VERSION = 4
-
-
-def page():
-    return {
-        "categories": [],
-        "files": [],
-        "links": [],
-        "templates": [],
-        "translations": [],
-        "digest": "",
-    }
-
-
-CATEGORIES = defaultdict(list)
-FILES = defaultdict(list)
+CACHE_FORMAT = "json"
+CACHE_VERSION = 5
+# After this many entries in the journal, the cache is written out in full.
+JOURNAL_COMPACT_ENTRIES = 1000
+# Amount of processes to use to index pages; 0 means one per CPU core.
+INDEX_WORKERS = 0
+# Amount of pages a worker analyzes before reporting back.
+INDEX_CHUNK_SIZE = 50
+# Minimum amount of pages to analyze before a pool of processes is used.
+INDEX_POOL_MINIMUM = 100
+# Seconds to analyze pages without a pool before letting other tasks run.
+INDEX_TIME_SLICE = 0.01
+# Seconds between progress reports while analyzing pages.
+INDEX_PROGRESS_INTERVAL = 5
+# Folders in storage that contain pages to index.
+INDEX_FOLDERS = ("Page", "Template", "Category", "File")
+# Whether to hash every page on (re)load, even if the stat didn't change.
+PARANOID_RESCAN = False
+
+
+# The index requests are served from. Every change builds a new one (or a
+# copy, for small changes), and only replaces this one when it is complete.
+INDEX = MetadataIndex()
+# Index used by the renders in this thread; see use_index().
+_THREAD_INDEX = threading.local()
+# Replaced, never changed, when languages are added or removed.
 LANGUAGES = set()
-LINKS = defaultdict(list)
-PAGES = defaultdict(page)
-PAGES_LC = {}
-TEMPLATES = defaultdict(list)
-TRANSLATIONS = defaultdict(list)
 LAST_TIME_RENDERED = {}
-
-RELOAD_BUSY = asyncio.Event()
-RELOAD_BUSY.set()
+# Bodies of rendered pages, for anonymous users.
+RENDERED_PAGES = PageCache()
+# Content of rendered pages, without the chrome; the same for every user.
+RENDERED_FRAGMENTS = PageCache()
+# Files of rendered pages, for anonymous users; only used with a cache folder.
+RENDERED_FILES = DiskCache()
+# Bodies and validators of invalidated pages, with when they were first
+# invalidated, in that order; see get_stale_page().
+STALE_PAGES = collections.OrderedDict()
+# Seconds an invalidated page can still be served; 0 disables this.
+STALE_MAX_AGE = 0
+# While a new index is being built, pages to invalidate once it is in use.
+DEFERRED_INVALIDATIONS = None
+# Increased on every invalidation of rendered pages. A render that started
+# before an invalidation might be outdated, and should not be cached.
+INVALIDATION_COUNT = 0
+# ETag and Last-Modified of pages; see get_validators().
+VALIDATORS = {}
+# When the rendering of a page was last invalidated, and when that last
+# happened for all pages at once.
+LAST_INVALIDATED = {}
+LAST_INVALIDATED_ALL = 0.0
+JOURNAL_ENTRIES = 0
+
+# Set once the metadata is loaded and validated against storage.
+LOADED = asyncio.Event()
+# Set after changes to the index are processed, and pages might have been
+# invalidated because of it.
+PAGES_INVALIDATED = asyncio.Event()
+# Work waiting for the metadata queue.
+QUEUE_PAGES = set()
+QUEUE_RELOAD = False
+QUEUE_TASK = None
 
 
 def _delete_cached_page(page):
+    global INVALIDATION_COUNT
+
+    # Until the new index is in use, pages are still rendered with the old
+    # one; invalidating them now would only cache those renders again.
+    if DEFERRED_INVALIDATIONS is not None:
+        DEFERRED_INVALIDATIONS.add(page)
+        return
+
     if page in LAST_TIME_RENDERED:
         del LAST_TIME_RENDERED[page]
+    rendered = RENDERED_PAGES.remove(page)
+    RENDERED_FRAGMENTS.remove(page)
+    if STALE_MAX_AGE and rendered is not None and page in VALIDATORS:
+        _keep_stale_page(page, rendered)
+    # Pages that are gone (or never had a file of their own) are removed from
+    # disk too; otherwise nothing would ever remove them.
+    if not INDEX.has_page(page):
+        RENDERED_FILES.remove(page)
+    VALIDATORS.pop(page, None)
+    LAST_INVALIDATED[page] = time.time()
+    INVALIDATION_COUNT += 1
+
+
+def _invalidate_all():
+    global INVALIDATION_COUNT, LAST_INVALIDATED_ALL
+
+    LAST_TIME_RENDERED.clear()
+    RENDERED_PAGES.clear()
+    RENDERED_FRAGMENTS.clear()
+    STALE_PAGES.clear()
+    VALIDATORS.clear()
+    LAST_INVALIDATED.clear()
+    LAST_INVALIDATED_ALL = time.time()
+    INVALIDATION_COUNT += 1
+
+
+def config_changed():
+    """Inform the metadata the configuration changed, which changes the rendering of every page."""
 
+    _invalidate_all()
+    if RENDERED_FILES.folder:
+        RENDERED_FILES.set_generation(get_generation()[0])
+    PAGES_INVALIDATED.set()
 
-def translation_callback(wtp, wiki_page, page):
+
+def templates_changed():
+    """Pick up changes to the wrapper templates, which change the rendering of every page."""
+
+    if wrapper.load_templates():
+        config_changed()
+
+
+def get_generation():
+    """
+    Return a digest and modification time of everything that changes the
+    rendering of every page: the configuration, the code and the wrapper
+    templates.
+    """
+
+    templates_digest, templates_time = wrapper.get_generation()
+    digest = hashlib.sha256(f"{config.GENERATION}\0{templates_digest}".encode()).hexdigest()
+    return digest, max(config.GENERATION_TIME, templates_time)
+
+
+def _keep_stale_page(page, rendered):
+    now = time.time()
+
+    while STALE_PAGES:
+        invalidated = next(iter(STALE_PAGES.values()))[3]
+        if now - invalidated <= STALE_MAX_AGE:
+            break
+        STALE_PAGES.popitem(last=False)
+
+    etag, last_modified = VALIDATORS[page]
+    STALE_PAGES[page] = (rendered, etag, last_modified, now)
+
+
+def get_stale_page(page):
+    """
+    Return the body, ETag and Last-Modified of a page as it was before it
+    got invalidated, if that was not longer than STALE_MAX_AGE ago.
+    """
+
+    stale = STALE_PAGES.get(page)
+    if stale is None:
+        return None
+
+    rendered, etag, last_modified, invalidated = stale
+    if time.time() - invalidated > STALE_MAX_AGE:
+        del STALE_PAGES[page]
+        return None
+    return rendered, etag, last_modified
+
+
+def _compute_validators(index, page):
+    generation, generation_time = get_generation()
+    digest = hashlib.sha256(generation.encode())
+    last_modified = max(generation_time, LAST_INVALIDATED_ALL, LAST_INVALIDATED.get(page, 0))
+
+    # Lists of pages shown on the page itself.
+    namespace, _, name = page.partition("/")
+    referring = [("templates", page), ("links", f":{namespace}:{name}")]
+    # Media shown on the page.
+    files = set()
+    if namespace == "Category":
+        referring.append(("categories", name))
+    elif namespace == "File":
+        referring.append(("files", name))
+        files.add(name)
+
+    # The page itself, and every template it (indirectly) uses.
+    seen = set()
+    worklist = [page]
+    while worklist:
+        dependency = worklist.pop()
+        if dependency in seen:
+            continue
+        seen.add(dependency)
+
+        data = index.get_page(dependency)
+        if data is None:
+            digest.update(f"{dependency}\0\0".encode())
+            continue
+        digest.update(f"{dependency}\0{data['digest']}\0".encode())
+        last_modified = max(last_modified, data["stat"][1] / 1_000_000_000)
+
+        worklist.extend(data["templates"])
+        referring.extend(("translations", translation) for translation in data["translations"])
+        files.update(data["files"])
+
+        # A link renders differently depending on whether its target exists.
+        for link in data["links"]:
+            link_namespace, _, link_name = link[1:].partition(":")
+            exists = index.has_page(f"{link_namespace}/{link_name}")
+            digest.update(f"{link}\0{exists:d}\0".encode())
+
+    for relation, target in referring:
+        digest.update(f"{relation}\0{target}\0".encode())
+        for member in index.get_referring(relation, target):
+            digest.update(f"{member}\0".encode())
+
+    # Media is not indexed; so whether it exists, and which version it is,
+    # comes from storage.
+    for file in sorted(files):
+        try:
+            stat = os.stat(f"{singleton.STORAGE.folder}/File/{file}")
+        except OSError:
+            digest.update(f"{file}\0\0".encode())
+            continue
+        digest.update(f"{file}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode())
+        last_modified = max(last_modified, stat.st_mtime)
+
+    # HTTP dates only have a resolution of seconds.
+    return digest.hexdigest(), math.floor(last_modified)
+
+
+def get_validators(page):
+    """
+    Return the ETag and Last-Modified of a rendered page.
+
+    Both are derived from what the page depends on, as known by the index,
+    so they are known without rendering the page; also right after a
+    restart. They change whenever the rendered page is invalidated.
+    """
+
+    validators = VALIDATORS.get(page)
+    if validators is None:
+        validators = _compute_validators(INDEX, page)
+        VALIDATORS[page] = validators
+    return validators
+
+
+def get_index():
+    """Return the index to use, for the current thread."""
+
+    return getattr(_THREAD_INDEX, "index", INDEX)
+
+
+@contextlib.contextmanager
+def use_index(index):
+    """
+    Use the given index in this thread, instead of INDEX.
+
+    INDEX is replaced on the event loop whenever the metadata changes. A
+    render in another thread would otherwise see one index halfway through
+    and another after. An index in use is never changed, only replaced.
+    """
+
+    _THREAD_INDEX.index = index
+    try:
+        yield
+    finally:
+        del _THREAD_INDEX.index
+
+
+def translation_callback(wtp, wiki_page):
+    targets = []
     for wikilink in wtp.wikilinks:
         if wikilink.target.startswith("Translation:"):
-            target = wikilink.target[len("Translation:") :].strip()
-            target = sys.intern(target)
-            PAGES[page]["translations"].append(target)
-            TRANSLATIONS[target].append(page)
-
-            # Reset the last time rendered for all translations too, as
-            # otherwise a new translation won't show up on those pages.
-            for translation in TRANSLATIONS[target]:
-                _delete_cached_page(translation)
+            targets.append(wikilink.target[len("Translation:") :].strip())
+    return targets
 
 
-def category_callback(wtp, wiki_page, page):
+def category_callback(wtp, wiki_page):
+    targets = []
     for wikilink in wtp.wikilinks:
         if wikilink.target.startswith("Category:"):
-            target = wikilink.target[len("Category:") :].strip()
-            target = sys.intern(target)
-            PAGES[page]["categories"].append(target)
-            CATEGORIES[target].append(page)
+            targets.append(wikilink.target[len("Category:") :].strip())
+    return targets
 
-            # Reset the last time rendered for the category.
-            _delete_cached_page(f"Category/{target}")
 
-
-def file_callback(wtp, wiki_page, page):
+def file_callback(wtp, wiki_page):
+    targets = []
     for wikilink in wtp.wikilinks:
         if wikilink.target.startswith("File:"):
-            target = wikilink.target[len("File:") :].strip()
-            target = sys.intern(target)
-            PAGES[page]["files"].append(target)
-            FILES[target].append(page)
-
-            # Reset the last time rendered for the file.
-            _delete_cached_page(f"File/{target}")
+            targets.append(wikilink.target[len("File:") :].strip())
+    return targets
 
 
-def links_callback(wtp, wiki_page, page):
+def links_callback(wtp, wiki_page):
+    targets = []
     for wikilink in wtp.wikilinks:
         if ":" not in wikilink.target or wikilink.target.startswith(":"):
             if ":" not in wikilink.target:
                 target = f":Page:{wikilink.target}"
             else:
                 target = wikilink.target
-            target = target.strip()
-            target = sys.intern(target)
-
-            PAGES[page]["links"].append(target)
-            LINKS[target].append(page)
+            targets.append(target.strip())
+    return targets
 
 
-def template_callback(wtp, wiki_page, page):
+def template_callback(wtp, wiki_page):
+    targets = []
     for template in wiki_page.templates:
         if ":" in template:
             namespace, _, template = template.partition(":")
         else:
             namespace = "Template"
 
-        target = f"{namespace}/{template}".strip()
-        target = sys.intern(target)
-        PAGES[page]["templates"].append(target)
-        TEMPLATES[target].append(page)
+        targets.append(f"{namespace}/{template}".strip())
+    return targets
 
 
-CALLBACKS = [
-    category_callback,
-    file_callback,
-    links_callback,
-    template_callback,
-    translation_callback,
-]
+# Every callback returns the targets of one type of link found in a page.
+# They have to be free of side-effects, as they can run in another process.
+CALLBACKS = {
+    "categories": category_callback,
+    "files": file_callback,
+    "links": links_callback,
+    "templates": template_callback,
+    "translations": translation_callback,
+}
 
 
-def _forget_page(page):
-    for category in PAGES[page]["categories"]:
-        CATEGORIES[category].remove(page)
+def _forget_page(page_data):
+    for category in page_data["categories"]:
         _delete_cached_page(f"Category/{category}")
-    for file in PAGES[page]["files"]:
-        FILES[file].remove(page)
+    for file in page_data["files"]:
         _delete_cached_page(f"File/{file}")
-    for link in PAGES[page]["links"]:
-        LINKS[link].remove(page)
-    for template in PAGES[page]["templates"]:
-        TEMPLATES[template].remove(page)
-    for translation in PAGES[page]["translations"]:
-        TRANSLATIONS[translation].remove(page)
-
+    for translation in page_data["translations"]:
         # Reset the last time rendered for all translations too, as
         # otherwise a removed translation will still show up on those pages.
         if not translation.startswith(("Category/", "File/", "Template/")):
             translation = f"Page/{translation}"
         _delete_cached_page(translation)
 
-    PAGES[page]["categories"].clear()
-    PAGES[page]["files"].clear()
-    PAGES[page]["links"].clear()
-    PAGES[page]["templates"].clear()
-    PAGES[page]["translations"].clear()
 
+def _extract_page(page, known_digest=None):
+    """
+    Parse a page and return what it links to.
 
-def _analyze_page(page):
-    # Remove the page first from our existing index.
-    if page in PAGES:
-        _forget_page(page)
+    The result is a dict with for every callback a list of targets, and the
+    digest and stat of the page. If the digest is equal to known_digest,
+    the page is not parsed and only the digest and stat are returned.
+    None is returned if the page no longer exists on disk.
+    """
 
-    # This file is removed since our last scan; forget about it.
-    if not os.path.exists(f"{singleton.STORAGE.folder}/{page}.mediawiki"):
-        # If the file is gone, remove it from our index completely.
-        if page in PAGES:
-            del PAGES[page]
-        return
+    filename = f"{singleton.STORAGE.folder}/{page}.mediawiki"
+    if not os.path.exists(filename):
+        return None
+
+    with open(filename, "rb") as fp:
+        raw_body = fp.read()
+        stat = os.fstat(fp.fileno())
+
+    record = {
+        "digest": hashlib.sha256(raw_body).hexdigest(),
+        "stat": [stat.st_size, stat.st_mtime_ns, stat.st_ino],
+    }
+    if record["digest"] == known_digest:
+        return record
 
-    # Analyze the file.
-    with open(f"{singleton.STORAGE.folder}/{page}.mediawiki", "r") as fp:
-        body = fp.read()
+    # Decode the same way as reading the file in text-mode would.
+    body = io.StringIO(raw_body.decode(), newline=None).read()
 
     if page.startswith("Page/"):
         page_name = page[len("Page/") :]
@@ -178,80 +401,253 @@ def _analyze_page(page):
     wiki_page = WikiPage(page_name)
     wtp = wiki_page.prepare(body)
 
-    # Ensure the page now exists in our list of pages.
-    PAGES[page]
+    for name, callback in CALLBACKS.items():
+        record[name] = callback(wtp, wiki_page)
+    return record
 
-    # Index this page again.
-    for callback in CALLBACKS:
-        callback(wtp, wiki_page, page)
 
+def _index_page(index, record):
+    for target in record["categories"]:
+        # Reset the last time rendered for the category.
+        _delete_cached_page(f"Category/{target}")
 
-async def _page_changed(page, notified=None):
-    page = sys.intern(page)
+    for target in record["files"]:
+        # Reset the last time rendered for the file.
+        _delete_cached_page(f"File/{target}")
 
-    # Allow other tasks to do something now. This fraction is sufficient
-    # to still return pages (while indexing), although with an increased
-    # latency.
-    await asyncio.sleep(0)
+    for target in record["translations"]:
+        # Reset the last time rendered for all translations too, as
+        # otherwise a new translation won't show up on those pages.
+        for translation in index.members("translations", target):
+            _delete_cached_page(translation)
 
-    if notified is None:
-        notified = set()
 
-    if page in notified:
-        return
+def _process_record(index, page, record):
+    """Process the result of _extract_page(); returns whether the page is changed."""
 
-    # As we are invalidating this page, also reset when we last rendered it.
-    # This means that on a next request for this page, browsers will be
-    # given a new version too.
-    _delete_cached_page(page)
+    # The content is unchanged, so only remember the new stat.
+    if record is not None and "templates" not in record:
+        index.set_stat(page, record["stat"])
+        return False
 
-    # Capture the current templates ued. After analysis, this might have
-    # changed, but those are still pages that need to be analyzed again.
-    dependencies = TEMPLATES[page].copy()
+    # This file is removed since our last scan; forget about it.
+    if record is None:
+        page_data = index.remove_page(page)
+    else:
+        page_data = index.set_page(page, record)
 
-    notified.add(page)
-    _analyze_page(page)
+    if page_data is not None:
+        _forget_page(page_data)
+    if record is None:
+        _delete_cached_page(page)
+    if record is not None:
+        _index_page(index, record)
+    return True
 
-    # Notify all dependencies of a page change.
-    for dependency in TEMPLATES[page] + dependencies:
-        await _page_changed(dependency, notified)
 
+def _initialize_worker(storage_folder, languages, generation):
+    global LANGUAGES
 
-async def _scan_folder(folder, notified=None):
-    pages_seen = set()
+    # Workers are started with "spawn", so nothing is initialized yet. Only
+    # reading from storage is needed to parse pages, which is the same for
+    # all storage backends.
+    from .namespaces import (  # noqa
+        category,
+        file,
+        folder,
+        page,
+        template,
+        translation,
+    )
+    from .storage import local
 
-    if notified is None:
-        notified = set()
+    local.STORAGE_FOLDER = storage_folder
+    singleton.STORAGE = local.Storage()
+    config.load(generation)
+
+    LANGUAGES = languages
+
+
+def _extract_pages(pages):
+    return [(page, _extract_page(page, known_digest)) for page, known_digest in pages]
+
+
+def _index_workers():
+    return INDEX_WORKERS or os.cpu_count() or 1
+
+
+def _create_executor(pages):
+    # Starting processes is not for free; so only use a pool if there is
+    # enough work to be done (like on a cold start).
+    if _index_workers() <= 1 or len(pages) < INDEX_POOL_MINIMUM:
+        return None
+
+    # Use "spawn" over "fork", as we don't need any variable from our
+    # current process. This heavily cuts back on memory usage, but it
+    # takes a bit longer to start up.
+    return futures.ProcessPoolExecutor(
+        max_workers=_index_workers(),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_initialize_worker,
+        initargs=(singleton.STORAGE.folder, LANGUAGES, (config.GENERATION, config.GENERATION_TIME)),
+    )
+
+
+async def _extract_in_pool(executor, pages):
+    loop = asyncio.get_event_loop()
+    tasks = [
+        loop.run_in_executor(executor, _extract_pages, pages[i : i + INDEX_CHUNK_SIZE])
+        for i in range(0, len(pages), INDEX_CHUNK_SIZE)
+    ]
+    for task in asyncio.as_completed(tasks):
+        for result in await task:
+            yield result
+
+
+async def _extract_in_time_slices(pages):
+    deadline = time.monotonic() + INDEX_TIME_SLICE
+    for page, known_digest in pages:
+        yield page, _extract_page(page, known_digest)
+
+        if time.monotonic() >= deadline:
+            # Allow other tasks to do something now. This is sufficient to
+            # still return pages (while indexing), although with an
+            # increased latency.
+            await asyncio.sleep(0)
+            deadline = time.monotonic() + INDEX_TIME_SLICE
 
-    for node in glob.glob(f"{singleton.STORAGE.folder}/{folder}/*"):
-        if os.path.isdir(node):
-            folder = node[len(singleton.STORAGE.folder) + 1 :]
-            pages_seen.update(await _scan_folder(folder, notified))
+
+async def _analyze_pages(index, pages, notified, executor):
+    """
+    Analyze a list of (page, known_digest), and merge the results back.
+
+    With an executor, the parsing, which is by far the most expensive part,
+    is spread over multiple cores. Returns the pages that are changed.
+    """
+
+    if executor is None:
+        results = _extract_in_time_slices(pages)
+    else:
+        results = _extract_in_pool(executor, pages)
+
+    changed = set()
+    done = 0
+    last_progress = time.monotonic()
+
+    async for page, record in results:
+        page = sys.intern(page)
+
+        done += 1
+        if time.monotonic() - last_progress >= INDEX_PROGRESS_INTERVAL:
+            log.info(f"Indexed {done} of {len(pages)} pages ...")
+            last_progress = time.monotonic()
+
+        if not _process_record(index, page, record):
             continue
+        notified.add(page)
+        changed.add(page)
+
+        # As we are invalidating this page, also reset when we last rendered it.
+        # This means that on a next request for this page, browsers will be
+        # given a new version too.
+        _delete_cached_page(page)
+        # Editing a file can come with a new upload; pages showing the file
+        # render differently then.
+        if page.startswith("File/"):
+            for dependency in index.get_referring("files", page[len("File/") :]):
+                _delete_cached_page(dependency)
+
+    return changed
+
+
+def _affected_pages(index, pages):
+    """Return all pages that (indirectly) use any of the pages as template."""
+
+    affected = set()
+    worklist = list(pages)
+    while worklist:
+        for dependency in index.members("templates", worklist.pop()):
+            if dependency not in affected:
+                affected.add(dependency)
+                worklist.append(dependency)
+    return affected
+
+
+async def _pages_changed(index, pages, notified, known_digests=None):
+    """
+    Analyze the pages, and all the pages that (indirectly) depend on them.
+
+    A page with a known digest is only analyzed if its content changed. The
+    pages depending on a changed page are collected before any of them is
+    analyzed, so every page is analyzed at most once.
+    """
+
+    if known_digests is None:
+        known_digests = {}
+
+    pages = [(page, known_digests.get(page)) for page in sorted(set(pages) - notified)]
+    executor = _create_executor(pages)
+
+    try:
+        changed = await _analyze_pages(index, pages, notified, executor)
+        if not changed:
+            return
+
+        # Analyzing a page only changes which templates that page uses, not
+        # which pages use it; so its dependencies are known at this point.
+        pages = [(page, None) for page in sorted(_affected_pages(index, changed) - notified)]
+        if executor is None:
+            executor = _create_executor(pages)
+
+        await _analyze_pages(index, pages, notified, executor)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
 
-        if node.endswith(".mediawiki"):
-            page = node[len(singleton.STORAGE.folder) + 1 : -len(".mediawiki")]
-            pages_seen.add(page)
+def _scan_languages():
+    global LANGUAGES
 
-            hash = hashlib.sha256()
-            with open(node, "rb") as fp:
-                hash.update(fp.read())
-            digest = hash.hexdigest()
+    # Index all languages (the superset of all folders in the namespaces);
+    # a language can exist before any page is written in it.
+    languages = {config.PRIMARY_LANGUAGE}
+    for folder in INDEX_FOLDERS:
+        languages.update(walk_folders(singleton.STORAGE.folder, folder))
 
-            # Use the hash of the file to see if this file is changed; if not,
-            # we can safely skip analyzing it again. If any template used in
-            # this page is changed, that template will trigger the correct
-            # chain of updates.
-            if PAGES[page]["digest"] == digest:
-                continue
-            PAGES[page]["digest"] = digest
+    LANGUAGES = languages
 
-            await _page_changed(page, notified)
+
+def _scan_folder(index, folder, pages_changed):
+    """
+    Find all pages in a folder, and which of those might have changed.
+
+    A page might have changed if its stat is different from what we know.
+    Only on analysis it is checked if the content is actually changed.
+    """
+
+    pages_seen = set()
+
+    for page, stat in walk_pages(singleton.STORAGE.folder, folder):
+        page = sys.intern(page)
+        pages_seen.add(page)
+
+        # Use the stat of the file to see if this file is changed; if not,
+        # we can safely skip analyzing it again. If any template used in
+        # this page is changed, that template will trigger the correct
+        # chain of updates.
+        if not PARANOID_RESCAN and index.get_stat(page) == [stat.st_size, stat.st_mtime_ns, stat.st_ino]:
+            continue
+
+        pages_changed.add(page)
 
     return pages_seen
 
 
 def check_for_exception(task):
+    # Tasks that run till shutdown are cancelled then.
+    if task.cancelled():
+        return
+
     exception = task.exception()
     if exception:
         log.exception("Exception in metadata_queue()", exc_info=exception)
@@ -262,27 +658,178 @@ def check_for_exception(task):
         sys.exit(1)
 
 
-def load_metadata():
+def _schedule_metadata_queue():
+    global QUEUE_TASK
+
+    if QUEUE_TASK is not None and not QUEUE_TASK.done():
+        return
+
     loop = asyncio.get_event_loop()
-    task = loop.create_task(metadata_queue("load_metadata", None))
-    task.add_done_callback(check_for_exception)
+    QUEUE_TASK = loop.create_task(metadata_queue())
+    QUEUE_TASK.add_done_callback(check_for_exception)
+
+
+def load_metadata():
+    global QUEUE_RELOAD
+
+    # A full reload picks up every change, so there is no need to process
+    # the pages that are still queued.
+    QUEUE_RELOAD = True
+    QUEUE_PAGES.clear()
+    _schedule_metadata_queue()
 
 
 def page_changed(pages):
-    loop = asyncio.get_event_loop()
-    loop.create_task(metadata_queue("page_changed", pages))
+    # A queued full reload will pick up these changes too.
+    if not QUEUE_RELOAD:
+        QUEUE_PAGES.update(pages)
+    _schedule_metadata_queue()
+
+
+def _media_changed(filename):
+    # The media of a file is not indexed, but the page of the file and every
+    # page showing it render differently when it changes or (dis)appears.
+    _delete_cached_page(filename)
+    for page in INDEX.get_referring("files", filename[len("File/") :]):
+        _delete_cached_page(page)
+    PAGES_INVALIDATED.set()
 
 
-async def metadata_queue(func, pages):
-    await RELOAD_BUSY.wait()
-    RELOAD_BUSY.clear()
+def files_changed(filenames):
+    """
+    Inform the metadata that files changed outside of the wiki, for example
+    after fetching the latest version from a remote repository.
+    """
+
+    # A fetch can add language folders without any page in them (yet).
+    _scan_languages()
+
+    pages = set()
+    for filename in filenames:
+        if not filename.startswith(tuple(f"{folder}/" for folder in INDEX_FOLDERS)):
+            continue
+        # Hidden files (like .keep, to keep a language folder) are not pages.
+        if filename.split("/")[-1].startswith("."):
+            continue
+
+        if filename.endswith(".mediawiki"):
+            pages.add(filename[: -len(".mediawiki")])
+        elif filename.startswith("File/"):
+            _media_changed(filename)
 
+    if pages:
+        page_changed(sorted(pages))
+
+
+async def metadata_queue():
+    """
+    Process all queued work, until there is nothing left to do.
+
+    Work is started right away. Changes made while processing are merged,
+    and handled as a single batch once the current batch is done.
+    """
+
+    global QUEUE_RELOAD
+
+    while QUEUE_RELOAD or QUEUE_PAGES:
+        if QUEUE_RELOAD:
+            QUEUE_RELOAD = False
+            await MetadataQueue(None).load_metadata()
+        else:
+            pages = sorted(QUEUE_PAGES)
+            QUEUE_PAGES.clear()
+            await MetadataQueue(pages).page_changed()
+
+
+def _journal_filename():
+    return f"{CACHE_FILENAME}.journal"
+
+
+def _journal_append(index, pages):
+    """
+    Append the current state of the pages to the journal.
+
+    The cache is only written after a full (re)load of the metadata. The
+    journal records every change made since, so after a restart only the
+    changes since the cache was written have to be replayed.
+    """
+    global JOURNAL_ENTRIES
+
+    with open(_journal_filename(), "a") as fp:
+        # A crash while writing can leave an incomplete entry at the end;
+        # start on a new line, so only that entry is lost.
+        if fp.tell() and not _journal_ends_with_newline():
+            fp.write("\n")
+
+        for page in sorted(pages):
+            page_data = index.get_page(page)
+            if page_data is not None:
+                entry = {"page": page, "data": page_data}
+            else:
+                entry = {"page": page}
+            fp.write(json.dumps(entry) + "\n")
+
+    JOURNAL_ENTRIES += len(pages)
+
+
+def _journal_ends_with_newline():
+    with open(_journal_filename(), "rb") as fp:
+        fp.seek(-1, os.SEEK_END)
+        return fp.read(1) == b"\n"
+
+
+def _journal_replay(index):
+    global DEFERRED_INVALIDATIONS, JOURNAL_ENTRIES
+
+    # The run that wrote the journal already invalidated what these changes
+    # affect; rendered pages it left behind are only reused if they are
+    # newer than the journal (see load_rendered_pages()). Invalidating them
+    # again would remove pages that are still up to date.
+    deferred_invalidations = DEFERRED_INVALIDATIONS
+    DEFERRED_INVALIDATIONS = set()
+
+    JOURNAL_ENTRIES = 0
     try:
-        instance = MetadataQueue(pages)
-        instance_func = getattr(instance, func)
-        await instance_func()
+        with open(_journal_filename(), "r") as fp:
+            for line in fp:
+                try:
+                    entry = json.loads(line, object_pairs_hook=object_pairs_hook)
+                except json.JSONDecodeError:
+                    # Most likely we crashed while writing this entry; entries
+                    # after it are written after a restart, and still valid.
+                    # Scanning the folders will find the lost change anyway.
+                    log.info("Journal has a corrupted entry; skipping it ...")
+                    continue
+
+                _process_record(index, entry["page"], entry.get("data"))
+                JOURNAL_ENTRIES += 1
     finally:
-        RELOAD_BUSY.set()
+        DEFERRED_INVALIDATIONS = deferred_invalidations
+
+
+def _journal_remove():
+    global JOURNAL_ENTRIES
+
+    if os.path.exists(_journal_filename()):
+        os.unlink(_journal_filename())
+    JOURNAL_ENTRIES = 0
+
+
+def _save_cache(index):
+    if CACHE_FORMAT == "binary":
+        cache = index.to_binary()
+        cache["version"] = CACHE_VERSION
+        metadata_cache.dump(CACHE_FILENAME, cache)
+    else:
+        payload = index.to_payload()
+        payload["version"] = CACHE_VERSION
+
+        with open(f"{CACHE_FILENAME}.tmp", "w") as fp:
+            fp.write(json.dumps(payload))
+        os.replace(f"{CACHE_FILENAME}.tmp", CACHE_FILENAME)
+
+    # Everything in the journal is now part of the cache.
+    _journal_remove()
 
 
 def object_pairs_hook(items):
@@ -299,7 +846,7 @@ def object_pairs_hook(items):
         if isinstance(value, dict):
             result[key] = object_pairs_hook(value.items())
         elif isinstance(value, list):
-            result[key] = [sys.intern(v) for v in value]
+            result[key] = [sys.intern(v) if isinstance(v, str) else v for v in value]
         elif isinstance(value, str):
             result[key] = sys.intern(value)
         elif isinstance(value, int):
@@ -313,123 +860,204 @@ def object_pairs_hook(items):
     return result
 
 
+def _load_cache(index):
+    if metadata_cache.is_binary(CACHE_FILENAME):
+        try:
+            cache = metadata_cache.load(CACHE_FILENAME)
+        except metadata_cache.CorruptedCacheError:
+            log.info("Cache was corrupted; reloading metadata ...")
+            return False
+
+        if cache["version"] != CACHE_VERSION:
+            return False
+
+        index.load_binary(cache)
+        return True
+
+    with open(CACHE_FILENAME, "r") as fp:
+        try:
+            payload = json.loads(fp.read(), object_pairs_hook=object_pairs_hook)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            log.info("Cache was corrupted; reloading metadata ...")
+            return False
+
+    if payload.get("version", 1) != CACHE_VERSION:
+        return False
+
+    index.load_payload(payload)
+    return True
+
+
+def _seed_last_invalidated():
+    """
+    Account for invalidations of the previous run; returns when the cache
+    (and journal) was last written.
+
+    Which pages were invalidated when is not stored; but every change to
+    the index is, in the cache or journal. So no page changed after that,
+    and pages are considered invalidated at that time. Otherwise a page
+    could be considered older than a change that rendered it differently,
+    like a link to it that was created.
+    """
+    global LAST_INVALIDATED_ALL
+
+    cache_time = os.path.getmtime(CACHE_FILENAME)
+    if os.path.exists(_journal_filename()):
+        cache_time = max(cache_time, os.path.getmtime(_journal_filename()))
+
+    LAST_INVALIDATED_ALL = max(LAST_INVALIDATED_ALL, cache_time)
+    return cache_time
+
+
+def load_stale_metadata():
+    """
+    Load the metadata as it was when the cache (and journal) was last
+    written, without validating it against storage.
+
+    This allows serving requests right away, while load_metadata() brings
+    everything up to date in the background. Returns when the cache was
+    last written, or None if there is no usable cache.
+    """
+    global INDEX
+
+    if not os.path.exists(CACHE_FILENAME):
+        return None
+
+    index = MetadataIndex()
+    if not _load_cache(index):
+        return None
+
+    if os.path.exists(_journal_filename()):
+        _journal_replay(index)
+
+    index.post()
+    INDEX = index
+
+    cache_time = _seed_last_invalidated()
+
+    _scan_languages()
+
+    log.info(f"Loaded metadata of {len(index)} pages from cache; validating in the background ...")
+    return cache_time
+
+
 class MetadataQueue:
     def __init__(self, pages):
         self.pages = pages
 
-    def _post(self):
-        # Sort everything so we don't have to on render time.
-        for category in CATEGORIES:
-            CATEGORIES[category] = sorted(set(CATEGORIES[category]), key=lambda x: list(reversed(x.split("/"))))
-        for file in FILES:
-            FILES[file] = sorted(set(FILES[file]), key=lambda x: list(reversed(x.split("/"))))
-        for link in LINKS:
-            LINKS[link] = sorted(set(LINKS[link]), key=lambda x: list(reversed(x.split("/"))))
-        for template in TEMPLATES:
-            TEMPLATES[template] = sorted(set(TEMPLATES[template]), key=lambda x: list(reversed(x.split("/"))))
-        for translation in TRANSLATIONS:
-            TRANSLATIONS[translation] = sorted(
-                set(TRANSLATIONS[translation]), key=lambda name: (name.find("en/") < 0, name)
-            )
+    async def page_changed(self):
+        global DEFERRED_INVALIDATIONS, INDEX
 
-        # Ensure there are no duplicated in PAGES too, and fill the PAGES_LC
-        # with a mapping from lowercase to real page name.
-        PAGES_LC.clear()
-        for page, page_data in PAGES.items():
-            page_data["categories"] = list(set(page_data["categories"]))
-            page_data["files"] = list(set(page_data["files"]))
-            page_data["links"] = list(set(page_data["links"]))
-            page_data["templates"] = list(set(page_data["templates"]))
-            page_data["translations"] = list(set(page_data["translations"]))
+        # Changes can come from outside the wiki, which can add (or remove)
+        # languages.
+        _scan_languages()
 
-            PAGES_LC[page.lower()] = page
+        # Changes are made to a copy of the index, which replaces the one in
+        # use once it is complete; like with a reload, requests never see a
+        # half-updated index.
+        index = INDEX.copy()
+        DEFERRED_INVALIDATIONS = set()
 
-        sitemap.invalidate_cache()
+        notified = set()
+        await _pages_changed(index, self.pages, notified)
 
-    async def page_changed(self):
-        for page in self.pages:
-            await _page_changed(page)
-        self._post()
-
-    def _load_metadata_from_cache(self):
-        with open(CACHE_FILENAME, "r") as fp:
-            try:
-                payload = json.loads(fp.read(), object_pairs_hook=object_pairs_hook)
-            except json.JSONDecodeError:
-                log.info("Cache was corrupted; reloading metadata ...")
-                return
-
-        if payload.get("version", 1) != CACHE_VERSION:
-            return
+        index.post()
+        INDEX = index
 
-        CATEGORIES.update(payload["categories"])
-        FILES.update(payload["files"])
-        LINKS.update(payload["links"])
-        PAGES.update(payload["pages"])
-        TEMPLATES.update(payload["templates"])
-        TRANSLATIONS.update(payload["translations"])
+        invalidations = DEFERRED_INVALIDATIONS
+        DEFERRED_INVALIDATIONS = None
+        for page in invalidations:
+            _delete_cached_page(page)
+        sitemap.invalidate_cache()
+        PAGES_INVALIDATED.set()
+
+        _journal_append(index, notified)
+        if JOURNAL_ENTRIES >= JOURNAL_COMPACT_ENTRIES:
+            _save_cache(index)
 
     async def load_metadata(self):
+        global DEFERRED_INVALIDATIONS, INDEX
+
         start = time.time()
         log.info("Loading metadata (this can take a while the first run) ...")
 
-        CATEGORIES.clear()
-        FILES.clear()
-        LANGUAGES.clear()
-        LINKS.clear()
-        PAGES.clear()
-        TEMPLATES.clear()
-        TRANSLATIONS.clear()
-        LAST_TIME_RENDERED.clear()
-
-        if os.path.exists(CACHE_FILENAME):
-            self._load_metadata_from_cache()
+        # Build a new index next to the one in use, so requests are served
+        # from a complete index for the whole duration of the reload.
+        index = MetadataIndex()
+        DEFERRED_INVALIDATIONS = set()
 
-        # Ensure the primary language is always available.
-        LANGUAGES.add(config.PRIMARY_LANGUAGE)
+        from_cache = os.path.exists(CACHE_FILENAME) and _load_cache(index)
+        if from_cache:
+            # Replay all changes made after the cache was written.
+            if os.path.exists(_journal_filename()):
+                _journal_replay(index)
+            _seed_last_invalidated()
 
-        # Ensure no file is scanned more than once.
-        notified = set()
         # Keep track of which pages we have seen.
         pages_seen = set()
+        # Keep track of which pages are changed since the last scan.
+        pages_changed = set()
         # Scan all folders with mediawiki files.
-        for subfolder in ("Page", "Template", "Category", "File"):
-            # Index all languages (the superset of all folders).
-            for node in glob.glob(f"{singleton.STORAGE.folder}/{subfolder}/*"):
-                if os.path.isdir(node):
-                    language = node.split("/")[-1]
-                    LANGUAGES.add(language)
-            pages_seen.update(await _scan_folder(f"{subfolder}", notified))
+        for subfolder in INDEX_FOLDERS:
+            pages_seen.update(_scan_folder(index, subfolder, pages_changed))
+
+        # Languages only depend on which folders exist, and analyzing pages
+        # already needs them; so these are replaced right away.
+        _scan_languages()
+
+        # Ensure no file is analyzed more than once.
+        notified = set()
+        # If the content of a page is the same as we know, it doesn't need
+        # to be analyzed again.
+        known_digests = {page: index.get_digest(page) for page in pages_changed}
+        await _pages_changed(index, pages_changed, notified, known_digests)
 
         # If we come from cache, validate that no file got removed; we should
         # forget about those.
-        pages_known = set(page for page in PAGES if PAGES[page]["digest"])
-        for page in pages_seen:
-            if page in pages_known:
-                pages_known.remove(page)
-        for page in pages_known:
-            _forget_page(page)
-            del PAGES[page]
-
-        self._post()
-
-        with open(CACHE_FILENAME, "w") as fp:
-            fp.write(
-                json.dumps(
-                    {
-                        "version": CACHE_VERSION,
-                        "categories": CATEGORIES,
-                        "files": FILES,
-                        "links": LINKS,
-                        "pages": PAGES,
-                        "templates": TEMPLATES,
-                        "translations": TRANSLATIONS,
-                    }
-                )
-            )
+        for page in set(index.pages()) - pages_seen:
+            _process_record(index, page, None)
+
+        # Swap in the new index; nothing in between awaits, so a request
+        # sees either the old or the new index, never something in between.
+        index.post()
+        INDEX = index
+
+        invalidations = DEFERRED_INVALIDATIONS
+        DEFERRED_INVALIDATIONS = None
+        if from_cache:
+            # Everything that changed since the cache was written is known.
+            for page in invalidations:
+                _delete_cached_page(page)
+        else:
+            _invalidate_all()
+            # Whatever was removed while we were not running, is still on disk.
+            RENDERED_FILES.retain(index.pages())
+        sitemap.invalidate_cache()
+        PAGES_INVALIDATED.set()
+
+        _save_cache(index)
+        LOADED.set()
 
         log.info(f"Loading metadata done; took {time.time() - start:.2f} seconds")
 
+        report = index.memory_report()
+        log.info(
+            f"Metadata index has {report['pages']} pages and {report['strings']} names; "
+            f"roughly {report['total_bytes'] / 1024 / 1024:.1f} MiB"
+        )
+
+        stats = RENDERED_PAGES.stats()
+        log.info(
+            f"Rendered page cache has {stats['pages']} pages in {stats['bytes'] / 1024 / 1024:.1f} MiB; "
+            f"{stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions"
+        )
+        if RENDERED_FILES.folder:
+            stats = RENDERED_FILES.stats()
+            log.info(
+                f"Rendered page cache on disk has {stats['pages']} pages in {stats['bytes'] / 1024 / 1024:.1f} MiB; "
+                f"{stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions"
+            )
+
 
 @click_helper.extend
 @click.option(
@@ -438,7 +1066,39 @@ class MetadataQueue:
     default=".cache_metadata.json",
     show_default=True,
 )
-def click_metadata(cache_metadata_file):
-    global CACHE_FILENAME
+@click.option(
+    "--cache-metadata-format",
+    help="Format used to write the metadata cache. Either format can always be read.",
+    type=click.Choice(["json", "binary"], case_sensitive=False),
+    default="json",
+    show_default=True,
+)
+@click.option(
+    "--metadata-index-workers",
+    help="Amount of processes used to index many pages at once. 0 means one per CPU core, 1 means no extra processes.",
+    default=0,
+    show_default=True,
+    type=click.IntRange(min=0),
+)
+@click.option(
+    "--metadata-index-time-slice",
+    help="Seconds to index pages without extra processes, before handling other tasks (like requests) again.",
+    default=0.01,
+    show_default=True,
+    type=click.FloatRange(min=0),
+)
+@click.option(
+    "--paranoid-rescan",
+    help="Hash every page on (re)load to find changes, instead of trusting their size and modification time.",
+    is_flag=True,
+)
+def click_metadata(
+    cache_metadata_file, cache_metadata_format, metadata_index_workers, metadata_index_time_slice, paranoid_rescan
+):
+    global CACHE_FILENAME, CACHE_FORMAT, INDEX_WORKERS, INDEX_TIME_SLICE, PARANOID_RESCAN
 
     CACHE_FILENAME = cache_metadata_file
+    CACHE_FORMAT = cache_metadata_format.lower()
+    INDEX_WORKERS = metadata_index_workers
+    INDEX_TIME_SLICE = metadata_index_time_slice
+    PARANOID_RESCAN = paranoid_rescan
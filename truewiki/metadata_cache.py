@@ -0,0 +1,190 @@
+"""
+Binary format for the metadata cache.
+
+Compared to the JSON format, every string is only stored (and interned)
+once, and all relations are stored as arrays of indices into that string
+table. This is close to how the metadata is kept in memory (see
+metadata_index), which makes loading the cache a lot cheaper, both in time
+and in peak memory usage.
+
+Layout (every integer is an unsigned 32-bit integer in little-endian byte-order,
+so a cache can be moved between machines):
+
+  header:    magic, format version, metadata version
+  strings:   count, (count + 1) offsets, UTF-8 encoded blob
+  pages:     count, string-id of every page, sha256 digest of every page,
+             size / modification time (in ns) / inode of every page (64-bit)
+  forward:   for every relation: (pages + 1) offsets, string-ids
+  reverse:   for every relation: count, string-id of every key,
+             (count + 1) offsets, string-ids
+
+In memory, a cache is a dict with the following keys:
+
+  version:   metadata version
+  strings:   list of strings
+  pages:     array with the string-id of every page
+  digests:   bytes with the sha256 digest of every page (all zeros if unknown)
+  stats:     array with size / modification time (in ns) / inode of every page
+  relations: for every relation a tuple (offsets, string-ids)
+  indexes:   for every relation a tuple (string-id of every key, offsets, string-ids)
+"""
+
+import mmap
+import os
+import struct
+import sys
+
+from array import array
+
+MAGIC = b"TWMC"
+FORMAT_VERSION = 3
+RELATIONS = ("categories", "files", "links", "templates", "translations")
+
+_HEADER = struct.Struct("<4sII")
+_DIGEST_SIZE = 32
+
+
+class CorruptedCacheError(Exception):
+    pass
+
+
+def is_binary(filename):
+    with open(filename, "rb") as fp:
+        return fp.read(len(MAGIC)) == MAGIC
+
+
+def _array(values=()):
+    result = array("I", values)
+    assert result.itemsize == 4
+    return result
+
+
+def _array64(values=()):
+    result = array("Q", values)
+    assert result.itemsize == 8
+    return result
+
+
+def _to_bytes(values):
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class _Reader:
+    def __init__(self, view):
+        self._view = view
+        self._pos = 0
+
+    def read_bytes(self, size):
+        if self._pos + size > len(self._view):
+            raise CorruptedCacheError("Unexpected end of file")
+
+        data = self._view[self._pos : self._pos + size].tobytes()
+        self._pos += size
+        return data
+
+    def read_header(self):
+        return _HEADER.unpack(self.read_bytes(_HEADER.size))
+
+    def read_array(self, count, result=None):
+        if result is None:
+            result = _array()
+        result.frombytes(self.read_bytes(count * result.itemsize))
+        if sys.byteorder != "little":
+            result.byteswap()
+        return result
+
+    def read_count(self):
+        return self.read_array(1)[0]
+
+    def read_string_table(self):
+        count = self.read_count()
+        offsets = self.read_array(count + 1)
+        blob = self.read_bytes(offsets[-1])
+
+        # Every string is only interned once, instead of every time it is used.
+        return [sys.intern(blob[offsets[i] : offsets[i + 1]].decode()) for i in range(count)]
+
+    def read_adjacency(self, count):
+        offsets = self.read_array(count + 1)
+        return offsets, self.read_array(offsets[-1])
+
+
+def dump(filename, cache):
+    """Write a cache to disk in the binary format."""
+
+    encoded = [string.encode() for string in cache["strings"]]
+    offsets = _array([0])
+    for string in encoded:
+        offsets.append(offsets[-1] + len(string))
+
+    # Write to a temporary file first, so a crash halfway never leaves a
+    # truncated cache behind.
+    with open(f"{filename}.tmp", "wb") as fp:
+        fp.write(_HEADER.pack(MAGIC, FORMAT_VERSION, cache["version"]))
+        fp.write(_to_bytes(_array([len(encoded)])))
+        fp.write(_to_bytes(offsets))
+        fp.write(b"".join(encoded))
+
+        fp.write(_to_bytes(_array([len(cache["pages"])])))
+        fp.write(_to_bytes(cache["pages"]))
+        fp.write(cache["digests"])
+        fp.write(_to_bytes(cache["stats"]))
+        for relation in RELATIONS:
+            for section in cache["relations"][relation]:
+                fp.write(_to_bytes(section))
+        for relation in RELATIONS:
+            keys, offsets, values = cache["indexes"][relation]
+            fp.write(_to_bytes(_array([len(keys)])))
+            for section in (keys, offsets, values):
+                fp.write(_to_bytes(section))
+    os.replace(f"{filename}.tmp", filename)
+
+
+def load(filename):
+    """Read a binary cache from disk."""
+
+    try:
+        with open(filename, "rb") as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as view:
+                return _load(_Reader(view))
+    except (struct.error, ValueError, IndexError) as e:
+        raise CorruptedCacheError(str(e))
+
+
+def _load(reader):
+    magic, format_version, version = reader.read_header()
+    if magic != MAGIC:
+        raise CorruptedCacheError("Not a binary metadata cache")
+
+    # A different format is handled as if the metadata itself is outdated.
+    if format_version != FORMAT_VERSION:
+        return {"version": None}
+
+    cache = {"version": version}
+    cache["strings"] = reader.read_string_table()
+
+    count = reader.read_count()
+    cache["pages"] = reader.read_array(count)
+    cache["digests"] = reader.read_bytes(count * _DIGEST_SIZE)
+    cache["stats"] = reader.read_array(count * 3, _array64())
+    cache["relations"] = {relation: reader.read_adjacency(count) for relation in RELATIONS}
+
+    cache["indexes"] = {}
+    for relation in RELATIONS:
+        count = reader.read_count()
+        keys = reader.read_array(count)
+        cache["indexes"][relation] = (keys, *reader.read_adjacency(count))
+
+    # Nothing is converted back to strings while loading, so validate here
+    # that every string-id actually exists.
+    ids = [cache["pages"]]
+    ids.extend(values for _, values in cache["relations"].values())
+    for keys, _, values in cache["indexes"].values():
+        ids.extend((keys, values))
+    if any(max(section, default=-1) >= len(cache["strings"]) for section in ids):
+        raise CorruptedCacheError("Unknown string-id")
+
+    return cache
@@ -0,0 +1,489 @@
+"""
+Compact in-memory representation of the metadata.
+
+Every name (of a page, or of a target a page refers to) is stored only once,
+in a string table. Everything else refers to it by its integer ID, stored
+in arrays instead of lists of Python objects. With tens of thousands of
+pages, this saves a lot of memory.
+
+Lookups never change the index; only the explicit mutations do. This way,
+requests for pages that don't exist (crawlers are good at finding those)
+don't grow the index, nor the cache written from it.
+"""
+
+import struct
+import sys
+
+from array import array
+
+RELATIONS = ("categories", "files", "links", "templates", "translations")
+
+# Digest and stat (size, modification time in ns, inode) of a page.
+_META = struct.Struct("=32sQQQ")
+_EMPTY_DIGEST = bytes(32)
+
+
+def _sort_by_path(name):
+    return list(reversed(name.split("/")))
+
+
+def _sort_english_first(name):
+    return (name.find("en/") < 0, name)
+
+
+_SORT_KEYS = {
+    "categories": _sort_by_path,
+    "files": _sort_by_path,
+    "links": _sort_by_path,
+    "templates": _sort_by_path,
+    "translations": _sort_english_first,
+}
+
+
+class StringTable:
+    """Two-way mapping between strings and integer IDs."""
+
+    __slots__ = ("_ids", "_strings")
+
+    def __init__(self):
+        self._ids = {}
+        self._strings = []
+
+    def __len__(self):
+        return len(self._strings)
+
+    def id(self, string):
+        try:
+            return self._ids[string]
+        except KeyError:
+            pass
+
+        string = sys.intern(string)
+        string_id = len(self._strings)
+        self._ids[string] = string_id
+        self._strings.append(string)
+        return string_id
+
+    def ids(self, strings):
+        try:
+            # Most of the time all strings are already known.
+            return array("I", map(self._ids.__getitem__, strings))
+        except KeyError:
+            return array("I", map(self.id, strings))
+
+    def string(self, string_id):
+        return self._strings[string_id]
+
+    def strings(self, string_ids):
+        return list(map(self._strings.__getitem__, string_ids))
+
+    def memory_size(self):
+        size = sys.getsizeof(self._ids) + sys.getsizeof(self._strings)
+        return size + sum(map(sys.getsizeof, self._strings))
+
+
+class _PageRecord:
+    """
+    What a single page refers to, and the digest and stat of its file.
+
+    Everything is packed in a single bytes object: first the digest and
+    stat, followed by the offset where every relation ends, followed by
+    the string IDs of all relations.
+    """
+
+    __slots__ = ("data",)
+
+    def __init__(self, digest, stat, relations):
+        offsets = array("I")
+        ids = array("I")
+        for relation_ids in relations:
+            ids.extend(relation_ids)
+            offsets.append(len(RELATIONS) + len(ids))
+
+        self.data = _META.pack(digest, *stat) + offsets.tobytes() + ids.tobytes()
+
+    def relations(self):
+        """Return for every relation a memoryview with its string IDs."""
+
+        edges = memoryview(self.data)[_META.size :].cast("I")
+        result = []
+        start = len(RELATIONS)
+        for end in edges[: len(RELATIONS)]:
+            result.append(edges[start:end])
+            start = end
+        return result
+
+    @property
+    def digest(self):
+        digest = self.data[:32]
+        return "" if digest == _EMPTY_DIGEST else digest.hex()
+
+    @property
+    def stat(self):
+        return list(_META.unpack_from(self.data)[1:])
+
+    def with_stat(self, stat):
+        """Return a copy of this record with another stat; records are shared between copies of an index."""
+
+        record = _PageRecord.__new__(_PageRecord)
+        record.data = _META.pack(self.data[:32], *stat) + self.data[_META.size :]
+        return record
+
+
+class _ReverseIndex:
+    """
+    Index from a target to the sorted list of pages referring to it.
+
+    The sorted lists are used on render time, and are stored as packed
+    page IDs. Changes are made to a set per key instead, so adding or
+    removing a page is O(1), no matter how many pages refer to the same
+    target. Only the keys that are actually changed have to be sorted again
+    after an update.
+    """
+
+    __slots__ = ("sorted", "changed", "_strings", "_sort_key")
+
+    def __init__(self, strings, sort_key):
+        self.sorted = {}
+        self.changed = {}
+        self._strings = strings
+        self._sort_key = sort_key
+
+    def ids(self, key):
+        data = self.sorted.get(key)
+        if data is None:
+            return ()
+        return memoryview(data).cast("I")
+
+    def members(self, key):
+        if key in self.changed:
+            return self.changed[key]
+        return self.ids(key)
+
+    def _members_to_change(self, key):
+        if key not in self.changed:
+            self.changed[key] = set(self.ids(key))
+        return self.changed[key]
+
+    def add(self, key, page_id):
+        self._members_to_change(key).add(page_id)
+
+    def remove(self, key, page_id):
+        self._members_to_change(key).remove(page_id)
+
+    def sort_dirty(self):
+        sort_key = self._sort_key
+        string = self._strings.string
+
+        def sort_key_by_id(page_id):
+            return sort_key(string(page_id))
+
+        for key, members in self.changed.items():
+            if members:
+                self.sorted[key] = array("I", sorted(members, key=sort_key_by_id)).tobytes()
+            else:
+                self.sorted.pop(key, None)
+        self.changed.clear()
+
+
+class MetadataIndex:
+    """
+    Everything known about the pages in storage, and how they refer to
+    each other.
+
+    For every relation (see RELATIONS) there is a reverse index, telling
+    which pages refer to a target. Mutations to those are only visible via
+    get_referring() after post() is called, which sorts everything that
+    changed.
+    """
+
+    def __init__(self):
+        self._strings = StringTable()
+        self._pages = {}
+        self._pages_lc = {}
+        self._indexes = {relation: _ReverseIndex(self._strings, _SORT_KEYS[relation]) for relation in RELATIONS}
+        # Pages that are added or removed since the last post().
+        self._dirty = set()
+
+    def __len__(self):
+        return len(self._pages)
+
+    def copy(self):
+        """
+        Return a copy of the index, which can be changed without changing
+        this one.
+
+        Only the containers are copied. Page records and sorted lists are
+        never changed in place, but replaced; so they are shared. So is the
+        string table, as strings are only ever added to it.
+        """
+
+        assert not self._dirty, "post() should be called first"
+
+        index = MetadataIndex.__new__(MetadataIndex)
+        index._strings = self._strings
+        index._pages = self._pages.copy()
+        index._pages_lc = self._pages_lc.copy()
+        index._indexes = {}
+        for relation, reverse_index in self._indexes.items():
+            assert not reverse_index.changed, "post() should be called first"
+
+            index._indexes[relation] = _ReverseIndex(self._strings, reverse_index._sort_key)
+            index._indexes[relation].sorted = reverse_index.sorted.copy()
+        index._dirty = set()
+        return index
+
+    def has_page(self, page):
+        return page in self._pages
+
+    def pages(self):
+        return list(self._pages)
+
+    def get_page(self, page):
+        """Return a dict with the relations, digest and stat of a page, or None if the page is unknown."""
+
+        record = self._pages.get(page)
+        if record is None:
+            return None
+
+        result = {relation: self._strings.strings(ids) for relation, ids in zip(RELATIONS, record.relations())}
+        result["digest"] = record.digest
+        result["stat"] = record.stat
+        return result
+
+    def get_digest(self, page):
+        record = self._pages.get(page)
+        return "" if record is None else record.digest
+
+    def get_stat(self, page):
+        record = self._pages.get(page)
+        return None if record is None else record.stat
+
+    def get_referring(self, relation, target):
+        """Return the (sorted) list of pages referring to the target."""
+        return self._strings.strings(self._indexes[relation].ids(target))
+
+    def has_referring(self, relation, target):
+        return target in self._indexes[relation].sorted
+
+    def members(self, relation, target):
+        """Return the pages referring to the target, including changes since the last post()."""
+        return self._strings.strings(self._indexes[relation].members(target))
+
+    def get_correct_case(self, page):
+        """Return the known page that matches when ignoring case, or the page itself if there is none."""
+        return self._pages_lc.get(page.lower(), page)
+
+    def set_page(self, page, data):
+        """
+        Set the relations, digest and stat of a page, from a dict like
+        get_page() returns. Returns what get_page() returned before.
+        """
+
+        previous = self._remove_relations(page)
+
+        # A page can refer to the same target multiple times, but the index
+        # only needs to know it once.
+        relations = [self._strings.ids(dict.fromkeys(data[relation])) for relation in RELATIONS]
+        digest = bytes.fromhex(data["digest"]) if data["digest"] else _EMPTY_DIGEST
+
+        page_id = self._strings.id(page)
+        page = self._strings.string(page_id)
+        self._pages[page] = _PageRecord(digest, data["stat"], relations)
+        self._dirty.add(page)
+
+        for relation, ids in zip(RELATIONS, relations):
+            index = self._indexes[relation]
+            for target in self._strings.strings(ids):
+                index.add(target, page_id)
+
+        return previous
+
+    def set_stat(self, page, stat):
+        self._pages[page] = self._pages[page].with_stat(stat)
+
+    def _remove_relations(self, page):
+        previous = self.get_page(page)
+        if previous is None:
+            return None
+
+        page_id = self._strings.id(page)
+        for relation in RELATIONS:
+            index = self._indexes[relation]
+            for target in previous[relation]:
+                index.remove(target, page_id)
+        return previous
+
+    def remove_page(self, page):
+        """Remove a page from the index. Returns what get_page() returned before."""
+
+        previous = self._remove_relations(page)
+        if previous is None:
+            return None
+
+        del self._pages[page]
+        self._dirty.add(page)
+        return previous
+
+    def post(self):
+        """Sort everything that changed, so this doesn't have to be done on render time."""
+
+        for index in self._indexes.values():
+            index.sort_dirty()
+
+        # Keep a mapping from lowercase to real page name up to date with
+        # the pages that are added or removed.
+        for page in self._dirty:
+            if page in self._pages:
+                self._pages_lc[page.lower()] = page
+            elif self._pages_lc.get(page.lower()) == page:
+                del self._pages_lc[page.lower()]
+        self._dirty.clear()
+
+    def memory_report(self):
+        """
+        Return what is stored in the index, with a rough estimate of the
+        amount of bytes used for it.
+        """
+
+        report = {
+            "pages": len(self._pages),
+            "strings": len(self._strings),
+            "strings_bytes": self._strings.memory_size(),
+            "pages_bytes": sys.getsizeof(self._pages)
+            + sys.getsizeof(self._pages_lc)
+            + sum(sys.getsizeof(record) + sys.getsizeof(record.data) for record in self._pages.values()),
+        }
+
+        for relation, index in self._indexes.items():
+            report[f"{relation}_keys"] = len(index.sorted)
+            report[f"{relation}_bytes"] = sys.getsizeof(index.sorted) + sum(map(sys.getsizeof, index.sorted.values()))
+
+        report["total_bytes"] = sum(value for key, value in report.items() if key.endswith("_bytes"))
+        return report
+
+    def to_payload(self):
+        """Return everything as plain dicts and lists, as stored in the JSON cache."""
+
+        payload = {}
+        for relation, index in self._indexes.items():
+            assert not index.changed, "post() should be called first"
+            payload[relation] = {key: self._strings.strings(index.ids(key)) for key in index.sorted}
+        payload["pages"] = {page: self.get_page(page) for page in self._pages}
+        return payload
+
+    def load_payload(self, payload):
+        """Load everything from the JSON cache, as returned by to_payload(). The index has to be empty."""
+
+        for page, data in payload["pages"].items():
+            page = self._strings.string(self._strings.id(page))
+            relations = [self._strings.ids(data[relation]) for relation in RELATIONS]
+            digest = bytes.fromhex(data["digest"]) if data["digest"] else _EMPTY_DIGEST
+            self._pages[page] = _PageRecord(digest, data["stat"], relations)
+            self._dirty.add(page)
+
+        # The reverse indexes are stored already sorted.
+        for relation, index in self._indexes.items():
+            for key, pages in payload[relation].items():
+                if pages:
+                    index.sorted[sys.intern(key)] = self._strings.ids(pages).tobytes()
+
+        self.post()
+
+    def to_binary(self):
+        """
+        Return everything in the layout of the binary cache.
+
+        See metadata_cache for the layout. Strings that are no longer used
+        are left out.
+        """
+
+        page_ids = array("I")
+        digests = []
+        stats = array("Q")
+        relations = {relation: (array("I", [0]), array("I")) for relation in RELATIONS}
+
+        for page, record in self._pages.items():
+            page_ids.append(self._strings.id(page))
+            digests.append(record.data[:32])
+            stats.extend(_META.unpack_from(record.data)[1:])
+
+            for (offsets, values), ids in zip(relations.values(), record.relations()):
+                values.frombytes(ids.tobytes())
+                offsets.append(len(values))
+
+        reverse = {}
+        for relation, index in self._indexes.items():
+            assert not index.changed, "post() should be called first"
+
+            keys = array("I")
+            offsets = array("I", [0])
+            values = array("I")
+            for key, data in index.sorted.items():
+                keys.append(self._strings.id(key))
+                values.frombytes(data)
+                offsets.append(len(values))
+            reverse[relation] = (keys, offsets, values)
+
+        strings = self._strings._strings
+        sections = [page_ids] + [values for _, values in relations.values()]
+        for keys, _, values in reverse.values():
+            sections.extend((keys, values))
+
+        used = set()
+        for section in sections:
+            used.update(section)
+        if len(used) != len(strings):
+            # Renumber the strings still in use, leaving out the rest.
+            used = sorted(used)
+            remap = array("I", bytes(4 * len(strings)))
+            for new_id, old_id in enumerate(used):
+                remap[old_id] = new_id
+            for section in sections:
+                section[:] = array("I", map(remap.__getitem__, section))
+            strings = [strings[old_id] for old_id in used]
+
+        return {
+            "strings": strings,
+            "pages": page_ids,
+            "digests": b"".join(digests),
+            "stats": stats,
+            "relations": relations,
+            "indexes": reverse,
+        }
+
+    def load_binary(self, cache):
+        """Load everything from the binary cache, as returned by to_binary(). The index has to be empty."""
+
+        remap = self._strings.ids(cache["strings"])
+        if remap == array("I", range(len(remap))):
+            # The usual case: the string table was empty, so the IDs are the same.
+            remap = None
+
+        def translate(ids):
+            if remap is None:
+                return ids
+            return array("I", map(remap.__getitem__, ids))
+
+        relations = [cache["relations"][relation] for relation in RELATIONS]
+        relations = [(offsets.tolist(), translate(values)) for offsets, values in relations]
+        digests = cache["digests"]
+        stats = cache["stats"]
+
+        for i, page_id in enumerate(translate(cache["pages"])):
+            page = self._strings.string(page_id)
+            self._pages[page] = _PageRecord(
+                digests[i * 32 : (i + 1) * 32],
+                stats[i * 3 : (i + 1) * 3],
+                [values[offsets[i] : offsets[i + 1]] for offsets, values in relations],
+            )
+            self._dirty.add(page)
+
+        for relation, index in self._indexes.items():
+            keys, offsets, values = cache["indexes"][relation]
+            values = translate(values)
+            for i, key_id in enumerate(translate(keys)):
+                if offsets[i] != offsets[i + 1]:
+                    index.sorted[self._strings.string(key_id)] = values[offsets[i] : offsets[i + 1]].tobytes()
+
+        self.post()
@@ -92,7 +92,7 @@ class Namespace:
 
     @staticmethod
     def page_get_correct_case(page: str) -> str:
-        return metadata.PAGES_LC.get(page.lower(), page)
+        return metadata.get_index().get_correct_case(page)
 
     @staticmethod
     def page_get_language(page: str) -> str:
@@ -20,7 +20,7 @@ def add_content(page: str) -> str:
 
     category_page = page[len("Category/") :]
 
-    for page_in_category in metadata.CATEGORIES.get(category_page, []):
+    for page_in_category in metadata.get_index().get_referring("categories", category_page):
         for namespace, prefix in NAMESPACE_MAPPING.items():
             if not page_in_category.startswith(namespace):
                 continue
@@ -73,7 +73,7 @@ class Namespace(base.Namespace):
 
         # If we know the category, the page exists; it might not have a
         # .mediawiki file (yet), but the page still exists.
-        if page[len("Category/") :] in metadata.CATEGORIES:
+        if metadata.get_index().has_referring("categories", page[len("Category/") :]):
             return True
 
         # The category is empty but if there is a mediawiki file for it, it
@@ -84,7 +84,8 @@ class Namespace(base.Namespace):
     def get_used_on_pages(page: str) -> list:
         assert page.startswith("Category/")
         page = page[len("Category/") :]
-        return metadata.TEMPLATES[f"Category/{page}"] + metadata.LINKS[f":Category:{page}"]
+        index = metadata.get_index()
+        return index.get_referring("templates", f"Category/{page}") + index.get_referring("links", f":Category:{page}")
 
     @classmethod
     def page_is_valid(cls, page: str, is_new_page: bool) -> Optional[str]:
@@ -110,7 +110,8 @@ class Namespace(base.Namespace):
     def get_used_on_pages(page: str) -> list:
         assert page.startswith("File/")
         page = page[len("File/") :]
-        return metadata.FILES[page] + metadata.LINKS[f":File:{page}"]
+        index = metadata.get_index()
+        return index.get_referring("files", page) + index.get_referring("links", f":File:{page}")
 
     @classmethod
     def has_source(cls, page: str) -> bool:
@@ -46,7 +46,8 @@ class Namespace(base.Namespace):
 
     @staticmethod
     def get_used_on_pages(page: str) -> list:
-        return metadata.TEMPLATES[f"Page/{page}"] + metadata.LINKS[f":Page:{page}"]
+        index = metadata.get_index()
+        return index.get_referring("templates", f"Page/{page}") + index.get_referring("links", f":Page:{page}")
 
     @staticmethod
     def page_is_valid(page: str, is_new_page: bool) -> Optional[str]:
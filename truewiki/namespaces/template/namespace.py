@@ -72,7 +72,8 @@ class Namespace(base.Namespace):
     def get_used_on_pages(page: str) -> list:
         assert page.startswith("Template/")
         page = page[len("Template/") :]
-        return metadata.TEMPLATES[f"Template/{page}"] + metadata.LINKS[f":Template:{page}"]
+        index = metadata.get_index()
+        return index.get_referring("templates", f"Template/{page}") + index.get_referring("links", f":Template:{page}")
 
     @classmethod
     def page_is_valid(cls, page: str, is_new_page: bool) -> Optional[str]:
@@ -0,0 +1,125 @@
+"""
+In-memory cache of rendered pages.
+
+Pages are kept in least-recently-used order; when the total size of all
+pages exceeds the budget, the least recently used pages are evicted till
+it fits again. Keys are the same as for metadata.LAST_TIME_RENDERED, and
+both are invalidated together.
+
+The same cache also holds the fragments of pages: their content without
+the chrome around it, which is the same for every user.
+
+Every page is compressed once, when it is added. Only the raw deflate
+stream is kept; the gzip and zlib ("deflate") formats only add a small
+header and trailer around that same stream, so both are created from it
+when served.
+"""
+
+import collections
+import struct
+import zlib
+
+COMPRESS_LEVEL = 6
+ENCODINGS = ("gzip", "deflate")
+
+# No filename, no modification time, unknown OS.
+_GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+# Deflate with a 32K window; the compression level is only informative.
+_ZLIB_HEADER = b"\x78\x9c"
+
+
+class RenderedPage:
+    def __init__(self, body: bytes):
+        self.body = body
+
+        compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self._deflated = compressor.compress(body) + compressor.flush()
+        self._gzip_trailer = struct.pack("<II", zlib.crc32(body), len(body) & 0xFFFFFFFF)
+        self._zlib_trailer = struct.pack(">I", zlib.adler32(body))
+
+    @property
+    def size(self):
+        return len(self.body) + len(self._deflated)
+
+    def get_body(self, encoding):
+        if encoding == "gzip":
+            return b"".join((_GZIP_HEADER, self._deflated, self._gzip_trailer))
+        if encoding == "deflate":
+            return b"".join((_ZLIB_HEADER, self._deflated, self._zlib_trailer))
+        return self.body
+
+
+class RenderedFragment:
+    """The content of a page, without the chrome around it; the same for every user."""
+
+    def __init__(self, templates, errors):
+        self.templates = templates
+        self.errors = errors
+
+    @property
+    def size(self):
+        return sum(len(value) for value in self.templates.values())
+
+
+class PageCache:
+    def __init__(self, budget=0):
+        # Maximum total size of all pages in bytes; 0 disables the cache.
+        self.budget = budget
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._pages = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._pages)
+
+    def __contains__(self, key):
+        return key in self._pages
+
+    def get(self, key):
+        page = self._pages.get(key)
+        if page is None:
+            self.misses += 1
+            return None
+
+        self._pages.move_to_end(key)
+        self.hits += 1
+        return page
+
+    def set(self, key, page):
+        self.remove(key)
+
+        # A page bigger than the budget would only evict everything else.
+        if page.size > self.budget:
+            return
+
+        self._pages[key] = page
+        self.size += page.size
+
+        while self.size > self.budget:
+            _, evicted = self._pages.popitem(last=False)
+            self.size -= evicted.size
+            self.evictions += 1
+
+    def remove(self, key):
+        page = self._pages.pop(key, None)
+        if page is not None:
+            self.size -= page.size
+        return page
+
+    def clear(self):
+        self._pages.clear()
+        self.size = 0
+
+    def stats(self):
+        return {
+            "pages": len(self._pages),
+            "bytes": self.size,
+            "budget": self.budget,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -154,7 +154,7 @@ class Storage(local.Storage):
             return
 
         if callback:
-            callback()
+            callback(result)
 
     def _run_out_of_process(self, callback, func, *args):
         loop = asyncio.get_event_loop()
@@ -177,7 +177,7 @@ class Storage(local.Storage):
 
         self._run_out_of_process(self.commit_done, "commit", *args)
 
-    def commit_done(self):
+    def commit_done(self, result):
         pass
 
     def file_write(self, filename: str, content, mode="w") -> None:
@@ -8,6 +8,7 @@ import urllib
 
 from openttd_helpers import click_helper
 
+from .. import metadata
 from .git import (
     OutOfProcessStorage as GitOutOfProcessStorage,
     Storage as GitStorage,
@@ -42,6 +43,13 @@ class OutOfProcessStorage(GitOutOfProcessStorage):
         log.info(f"Updating storage to latest version from {self.name}")
 
         origin = self._git.remotes.origin
+        old_head = self._git.head.commit
+
+        # Local changes not part of a commit are thrown away by the checkout
+        # below, so these files change too.
+        changed_files = set()
+        for diff in self._git.index.diff(None) + self._git.index.diff(old_head):
+            changed_files.update([diff.a_path, diff.b_path])
 
         git_env = {}
         if self._ssh_command:
@@ -67,6 +75,10 @@ class OutOfProcessStorage(GitOutOfProcessStorage):
 
         for file_name in self._git.untracked_files:
             os.unlink(f"{self._folder}/{file_name}")
+            changed_files.add(file_name)
+
+        for diff in old_head.diff(self._git.head.commit):
+            changed_files.update([diff.a_path, diff.b_path])
 
         # We might end up with empty folders, which the rest of the
         # application doesn't really like. So remove them. Keep repeating the
@@ -74,7 +86,8 @@ class OutOfProcessStorage(GitOutOfProcessStorage):
         while self._remove_empty_folders(self._folder):
             pass
 
-        return True
+        changed_files.discard(None)
+        return sorted(changed_files)
 
     def push(self, branch):
         git_env = {}
@@ -127,11 +140,17 @@ class Storage(GitStorage):
     def reload(self):
         self._run_out_of_process(self._reload_done, "fetch_latest", _github_branch)
 
-    def _reload_done(self):
-        super().reload()
+    def _reload_done(self, changed_files):
+        # The first time we load everything; after that, only the files
+        # that changed between the old and new HEAD have to be looked at.
+        if not self.ready.is_set():
+            super().reload()
+            return
+
+        metadata.files_changed(changed_files)
 
-    def commit_done(self):
-        super().commit_done()
+    def commit_done(self, result):
+        super().commit_done(result)
         self._run_out_of_process(None, "push", _github_branch)
 
     def get_history_url(self, page):
@@ -6,6 +6,7 @@ import urllib
 
 from openttd_helpers import click_helper
 
+from .. import metadata
 from .git import Storage as GitStorage
 from .github import OutOfProcessStorage as GitHubOutOfProcessStorage
 
@@ -51,11 +52,17 @@ class Storage(GitStorage):
     def reload(self):
         self._run_out_of_process(self._reload_done, "fetch_latest", _gitlab_branch)
 
-    def _reload_done(self):
-        super().reload()
+    def _reload_done(self, changed_files):
+        # The first time we load everything; after that, only the files
+        # that changed between the old and new HEAD have to be looked at.
+        if not self.ready.is_set():
+            super().reload()
+            return
 
-    def commit_done(self):
-        super().commit_done()
+        metadata.files_changed(changed_files)
+
+    def commit_done(self, result):
+        super().commit_done(result)
         self._run_out_of_process(None, "push", _gitlab_branch)
 
     def get_history_url(self, page):
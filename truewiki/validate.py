@@ -1,20 +1,10 @@
-import glob
-import os
-
 from . import singleton
+from .walker import walk_pages
 from .wiki_page import WikiPage
 
 
-def validate_folder(folder, ignore_index, errors):
-    for item in sorted(glob.glob(f"{folder}/*")):
-        if os.path.isdir(item):
-            validate_folder(item, ignore_index, errors)
-            continue
-
-        if not item.endswith(".mediawiki"):
-            continue
-
-        item = item[ignore_index : -len(".mediawiki")]
+def validate_folder(folder, errors):
+    for item, _ in walk_pages(folder):
         if item.startswith("Page/"):
             item = item[len("Page/") :]
 
@@ -38,4 +28,4 @@ def validate_folder(folder, ignore_index, errors):
 
 
 def all(errors):
-    validate_folder(singleton.STORAGE.folder, len(singleton.STORAGE.folder) + 1, errors)
+    validate_folder(singleton.STORAGE.folder, errors)
@@ -15,6 +15,11 @@ from ..wiki_page import WikiPage
 
 
 def save(user, old_page: str, new_page: str, content: str, payload, summary: str = None) -> web.Response:
+    # Storage is brought up to date in the background after a start with
+    # stale caches; a change made before that is done could be lost.
+    if not singleton.STORAGE.ready.is_set():
+        return error.view(user, old_page, "The wiki is still starting up; please try again in a moment.")
+
     wiki_page = WikiPage(old_page)
     page_error = wiki_page.page_is_valid(old_page, is_new_page=True)
     if page_error:
@@ -69,7 +74,9 @@ def save(user, old_page: str, new_page: str, content: str, payload, summary: str
 
         # Validate that if the page exists, we are not renaming it while there are
         # other pages depending on us
-        if wiki_page.page_exists(old_page) and metadata.TEMPLATES[old_filename[: -len(".mediawiki")]]:
+        if wiki_page.page_exists(old_page) and metadata.INDEX.has_referring(
+            "templates", old_filename[: -len(".mediawiki")]
+        ):
             return error.view(user, old_page, "Cannot rename page as other pages depend on it.")
 
     # Check with the namespace callback if there is an error.
@@ -1,40 +1,471 @@
 import aiohttp
+import asyncio
 import click
-import hashlib
+import collections
+import functools
+import logging
 import os
+import threading
 import time
+import weakref
 
 from aiohttp import web
+from concurrent import futures
 from openttd_helpers import click_helper
+from wikitexthtml.render import parser_function
 
 from . import error
 from .. import metadata
 from ..content import breadcrumb
+from ..page_cache import (
+    ENCODINGS,
+    RenderedFragment,
+    RenderedPage,
+)
 from ..wiki_page import WikiPage
 from ..wrapper import wrap_page
 
+log = logging.getLogger(__name__)
+
 CACHE_PAGE_FOLDER = None
+# Pages in the disk cache of at least this size (in bytes) are sent from disk
+# with sendfile; smaller pages are read and kept in memory.
+SENDFILE_SIZE = 64 * 1024
+# Threads to render pages in; None renders on the event loop.
+RENDER_EXECUTOR = None
+RENDER_WORKERS = 0
+
+# wikitexthtml evaluates expressions with a single module-level parser,
+# which keeps its state while parsing; only one render at the time can use
+# it. See _serialize_expressions().
+_expression_lock = threading.Lock()
+
+# Renders submitted to RENDER_EXECUTOR that are not done yet.
+_renders_pending = 0
+_render_count = 0
+_render_seconds = 0.0
+_render_seconds_max = 0.0
+# Renders for anonymous users, by page, that other requests can wait for.
+_renders_in_flight = {}
+_renders_coalesced = 0
+
+# Amount of pages to render at the same time, after they got invalidated
+# and before anyone asks for them; 0 disables this.
+PRERENDER_WORKERS = 0
+# Fraction of time spent on pre-rendering pages.
+PRERENDER_CPU = 0.5
+# Seconds after which the count of requests for a page is halved.
+REQUEST_COUNT_HALF_LIFE = 3600
+
+# Requests by anonymous users, by page; pages asked for recently are
+# pre-rendered, most requested first.
+_request_counts = collections.Counter()
+_request_counts_decayed = time.monotonic()
+_prerender_queue = collections.deque()
+_prerender_count = 0
+# Renders of stale pages, by page; see _revalidate().
+_revalidations = {}
+_stale_count = 0
+
+
+def _serialize(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with _expression_lock:
+            return function(*args, **kwargs)
+
+    return wrapper
+
+
+def _serialize_expressions():
+    """Make renders in different threads take turns evaluating expressions."""
 
+    for name in ("#expr", "#ifexpr"):
+        function = parser_function.PARSER_FUNCTIONS[name]
+        if not hasattr(function, "__wrapped__"):
+            parser_function.PARSER_FUNCTIONS[name] = _serialize(function)
 
-def _view(wiki_page, user, page: str) -> web.Response:
+
+def _render_fragment(wiki_page, page: str) -> RenderedFragment:
     templates = {
         "content": wiki_page.render().html,
         "breadcrumbs": breadcrumb.create(page),
     }
+
+    templates["language"] = wiki_page.add_language(page)
+    templates["footer"] = wiki_page.add_footer(page)
+    templates["content"] += wiki_page.add_content(page)
+
+    return RenderedFragment(templates, len(wiki_page.errors) if wiki_page.errors else "")
+
+
+def _view(wiki_page, user, page: str, fragment=None):
+    # Only the chrome around the content differs per user.
+    if fragment is None:
+        fragment = _render_fragment(wiki_page, page)
+
     variables = {
         "display_name": user.display_name if user else "",
         "user_settings_url": user.get_settings_url() if user else "",
-        "errors": len(wiki_page.errors) if wiki_page.errors else "",
+        "errors": fragment.errors,
     }
 
-    templates["language"] = wiki_page.add_language(page)
-    templates["footer"] = wiki_page.add_footer(page)
-    templates["content"] += wiki_page.add_content(page)
+    return wrap_page(page, "Page", variables, fragment.templates), fragment
+
+
+def _timed_view(wiki_page, user, page: str, fragment, compress):
+    start = time.monotonic()
+    body, fragment = _view(wiki_page, user, page, fragment)
+    seconds = time.monotonic() - start
+
+    if compress:
+        body = RenderedPage(body.encode("utf-8"))
+    return body, fragment, seconds
+
+
+def _timed_view_in_thread(index, wiki_page, user, page: str, compress):
+    # The index can be replaced while the page renders; the whole render
+    # uses the index as it was when it started.
+    with metadata.use_index(index):
+        return _timed_view(wiki_page, user, page, None, compress)
+
+
+async def _render(wiki_page, user, page: str, fragment=None, compress=False):
+    """
+    Render a page; if the fragment of the page is given, only the chrome
+    around it is rendered.
+
+    Returns the body (a RenderedPage if compress is set) and the fragment.
+    """
+
+    global _renders_pending, _render_count, _render_seconds, _render_seconds_max
+
+    # With the fragment, what is left is cheap enough for the event loop.
+    if RENDER_EXECUTOR is None or fragment is not None:
+        body, fragment, seconds = _timed_view(wiki_page, user, page, fragment, compress)
+    else:
+        # Rendering is CPU bound, and threads don't change that. But it does
+        # mean the event loop gets its turn while a heavy page renders, so
+        # cheap requests are not stuck behind it. Compressing the result is
+        # done in the thread too.
+        _renders_pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            body, fragment, seconds = await loop.run_in_executor(
+                RENDER_EXECUTOR, _timed_view_in_thread, metadata.INDEX, wiki_page, user, page, compress
+            )
+        finally:
+            _renders_pending -= 1
+
+    _render_count += 1
+    _render_seconds += seconds
+    _render_seconds_max = max(_render_seconds_max, seconds)
+    return body, fragment
+
+
+async def _render_and_cache(wiki_page, user, page: str, namespaced_page: str):
+    """
+    Render a page, and remember when it was rendered. For anonymous users
+    the result is also cached, in memory and on disk.
+
+    Returns the body (a RenderedPage for anonymous users), and whether it
+    was cached.
+    """
+
+    invalidation_count = metadata.INVALIDATION_COUNT
+    cached_fragment = metadata.RENDERED_FRAGMENTS.get(namespaced_page)
+    body, fragment = await _render(wiki_page, user, page, cached_fragment, compress=not user)
+
+    # If anything was invalidated during the render, it might have used
+    # outdated metadata; serve it, but don't cache it.
+    if invalidation_count != metadata.INVALIDATION_COUNT:
+        return body, False
+
+    if cached_fragment is None:
+        metadata.RENDERED_FRAGMENTS.set(namespaced_page, fragment)
+
+    if not user and CACHE_PAGE_FOLDER:
+        page_time = metadata.RENDERED_FILES.set(namespaced_page, body)
+    else:
+        # Accuracy of time.time() is higher than getmtime(), so
+        # depending if we cached, use a different clock.
+        page_time = time.time()
 
-    return wrap_page(page, "Page", variables, templates)
+    # Only update the time if we don't have one yet. This makes sure
+    # that LAST_TIME_RENDERED has the oldest timestamp possible.
+    if namespaced_page not in metadata.LAST_TIME_RENDERED:
+        metadata.LAST_TIME_RENDERED[namespaced_page] = page_time
+
+    if not user:
+        metadata.RENDERED_PAGES.set(namespaced_page, body)
+        metadata.STALE_PAGES.pop(namespaced_page, None)
+    return body, True
+
+
+def _render_shared(wiki_page, page: str, namespaced_page: str):
+    """
+    Render a page for anonymous users, sharing the render with all other
+    requests for the same page that come in while it is being rendered.
+    """
+
+    global _renders_coalesced
+
+    # After an invalidation, a render already in flight might be outdated;
+    # new requests start a render of their own.
+    key = (namespaced_page, metadata.INVALIDATION_COUNT)
+
+    task = _renders_in_flight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_render_and_cache(wiki_page, None, page, namespaced_page))
+        _renders_in_flight[key] = task
+        task.add_done_callback(lambda _: _renders_in_flight.pop(key))
+    else:
+        _renders_coalesced += 1
+
+    # Other requests depend on this render too; a request that goes away
+    # should not cancel it for them.
+    return asyncio.shield(task)
+
+
+def _revalidate(wiki_page, page: str, namespaced_page: str):
+    """Render a stale page again in the background, unless that already happens."""
+
+    if namespaced_page in _revalidations:
+        return
+
+    def done(future):
+        del _revalidations[namespaced_page]
+        if not future.cancelled() and future.exception():
+            log.error(f"Failed to render {namespaced_page}", exc_info=future.exception())
+
+    future = _render_shared(wiki_page, page, namespaced_page)
+    _revalidations[namespaced_page] = future
+    future.add_done_callback(done)
+
+
+def _decay_request_counts():
+    global _request_counts_decayed
+
+    while time.monotonic() - _request_counts_decayed >= REQUEST_COUNT_HALF_LIFE:
+        _request_counts_decayed += REQUEST_COUNT_HALF_LIFE
+
+        for namespaced_page, count in list(_request_counts.items()):
+            if count > 1:
+                _request_counts[namespaced_page] = count // 2
+            else:
+                del _request_counts[namespaced_page]
+
+
+async def _prerender_page(namespaced_page):
+    global _prerender_count
+
+    # Someone asked for it in the meantime.
+    if namespaced_page in metadata.LAST_TIME_RENDERED:
+        return
+
+    page = namespaced_page
+    if page.startswith("Page/"):
+        page = page[len("Page/") :]
+
+    wiki_page = WikiPage(page)
+    if not wiki_page.page_exists(page):
+        _request_counts.pop(namespaced_page, None)
+        return
+
+    start = time.monotonic()
+    try:
+        await _render_shared(wiki_page, page, namespaced_page)
+    except Exception:
+        log.exception(f"Failed to pre-render {namespaced_page}")
+        return
+    seconds = time.monotonic() - start
+
+    _prerender_count += 1
+
+    # Leave the rest of the time for requests.
+    await asyncio.sleep(seconds * (1 - PRERENDER_CPU) / PRERENDER_CPU)
+
+
+async def _prerender_worker():
+    while _prerender_queue:
+        await _prerender_page(_prerender_queue.popleft())
+
+
+async def prerender():
+    """
+    Render pages again after they got invalidated, before anyone asks for
+    them. Only pages asked for recently are rendered, most requested first.
+    """
+
+    while True:
+        try:
+            await asyncio.wait_for(metadata.PAGES_INVALIDATED.wait(), REQUEST_COUNT_HALF_LIFE)
+        except asyncio.TimeoutError:
+            pass
+        _decay_request_counts()
+
+        if not metadata.PAGES_INVALIDATED.is_set():
+            continue
+        metadata.PAGES_INVALIDATED.clear()
+
+        _prerender_queue.clear()
+        for namespaced_page, _ in _request_counts.most_common():
+            if namespaced_page not in metadata.LAST_TIME_RENDERED:
+                _prerender_queue.append(namespaced_page)
+
+        await asyncio.gather(*[_prerender_worker() for _ in range(PRERENDER_WORKERS)])
+
+
+def start_prerender():
+    if not PRERENDER_WORKERS:
+        return
+
+    loop = asyncio.get_event_loop()
+    task = loop.create_task(prerender())
+    task.add_done_callback(metadata.check_for_exception)
+
+
+def render_stats():
+    return {
+        "workers": RENDER_WORKERS,
+        "queued": max(0, _renders_pending - RENDER_WORKERS),
+        "running": min(_renders_pending, RENDER_WORKERS),
+        "rendered": _render_count,
+        "coalesced": _renders_coalesced,
+        "prerendered": _prerender_count,
+        "prerender_queued": len(_prerender_queue),
+        "served_stale": _stale_count,
+        "seconds_total": round(_render_seconds, 3),
+        "seconds_max": round(_render_seconds_max, 3),
+    }
 
 
-def view(user, page: str, if_modified_since, if_none_match) -> web.Response:
+def _select_encoding(accept_encoding) -> str:
+    qualities = {}
+    for coding in accept_encoding.lower().split(","):
+        coding, _, params = coding.partition(";")
+        params = params.strip()
+
+        quality = 1.0
+        if params.startswith("q="):
+            try:
+                quality = float(params[len("q=") :])
+            except ValueError:
+                quality = 0.0
+        qualities[coding.strip()] = quality
+
+    best_encoding = "identity"
+    best_quality = 0.0
+    for encoding in ENCODINGS:
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best_encoding = encoding
+            best_quality = quality
+    return best_encoding
+
+
+def _variant_etag(etag, encoding) -> str:
+    # Every encoding is a different representation, so it has its own ETag.
+    if encoding == "identity":
+        return etag
+    return f"{etag}-{encoding}"
+
+
+def _is_not_modified(user, etag, last_modified, if_none_match, if_modified_since):
+    # If-None-Match takes precedence over If-Modified-Since.
+    if if_none_match is not None:
+        # Only anonymous users get an ETag, as the page is different for
+        # every user.
+        return not user and ("*" in if_none_match or etag in if_none_match)
+    return if_modified_since is not None and last_modified <= if_modified_since.timestamp()
+
+
+def _rendered_response(rendered, encoding, status_code) -> web.Response:
+    response = web.Response(body=rendered.get_body(encoding), content_type="text/html", status=status_code)
+    if encoding != "identity":
+        response.headers["Content-Encoding"] = encoding
+    return response
+
+
+class PageFileResponse(web.FileResponse):
+    """
+    A page from the disk cache, sent with sendfile.
+
+    The view already picked the encoding (and with that, the file) and
+    handled the conditional request. FileResponse would do both again,
+    based on the file instead of the page, so it gets a request without
+    those headers. Its validators are replaced with those of the page in
+    on_response_prepare().
+
+    The page is held in the disk cache till the response is prepared (or
+    never will be), so it is not removed before FileResponse opened it.
+    """
+
+    def __init__(self, path, encoding, status, page_filename):
+        super().__init__(path, status=status, headers={"Content-Type": "text/html"})
+        self._release = weakref.finalize(self, metadata.RENDERED_FILES.release, page_filename)
+        if encoding != "identity":
+            self.headers["Content-Encoding"] = encoding
+        # Filled in by the view, once the headers are known.
+        self.page_headers = {}
+
+    def _range_allowed(self, request):
+        if_range = request.headers["If-Range"]
+        if if_range.startswith(('"', "W/")):
+            return if_range == self.page_headers.get("ETag")
+
+        date = request.if_range
+        return date is not None and self.last_modified is not None and self.last_modified <= date
+
+    async def prepare(self, request):
+        headers = request.headers.copy()
+        for header in ("Accept-Encoding", "If-Match", "If-Modified-Since", "If-None-Match", "If-Unmodified-Since"):
+            headers.popall(header, None)
+        if "If-Range" in headers:
+            if not self._range_allowed(request):
+                headers.popall("Range", None)
+            del headers["If-Range"]
+
+        try:
+            return await super().prepare(request.clone(headers=headers))
+        finally:
+            self._release()
+
+
+async def on_response_prepare(request, response):
+    if isinstance(response, PageFileResponse):
+        response.headers.update(response.page_headers)
+
+
+def _disk_response(page_filename, encoding, status_code, page_time):
+    """
+    Return a response to send the page from disk with, if the page is big
+    enough for that; otherwise None.
+    """
+
+    if encoding == "gzip":
+        cache_filename = f"{page_filename}.gz"
+    elif encoding == "identity":
+        cache_filename = page_filename
+    else:
+        return None
+
+    try:
+        stat = os.stat(cache_filename)
+    except FileNotFoundError:
+        return None
+    if stat.st_mtime < page_time or stat.st_size < SENDFILE_SIZE:
+        return None
+
+    # Hold the page before the file could be removed, which only happens on
+    # the event loop.
+    metadata.RENDERED_FILES.hold(page_filename)
+    return PageFileResponse(cache_filename, encoding, status_code, page_filename)
+
+
+async def view(user, page: str, if_modified_since, if_none_match, accept_encoding="") -> web.Response:
+    global _stale_count
+
     if page.endswith("/"):
         page += "Main Page"
 
@@ -59,87 +490,144 @@ def view(user, page: str, if_modified_since, if_none_match) -> web.Response:
 
     can_cache = status_code == 200 and not namespaced_page.startswith("Folder/")
 
-    if CACHE_PAGE_FOLDER:
-        cache_filename = f"{CACHE_PAGE_FOLDER}/{namespaced_page}.html"
+    # Anonymous users get a compressed variant from the cache, if they accept
+    # one. Every variant has its own ETag, all based on the same hash.
+    if can_cache and not user:
+        encoding = _select_encoding(accept_encoding)
     else:
-        cache_filename = None
+        encoding = "identity"
 
     response = None
+    rendered = None
 
-    # Check as we might have this page already on cache.
-    if can_cache and namespaced_page in metadata.LAST_TIME_RENDERED:
-        if (
-            if_modified_since is not None
-            and metadata.LAST_TIME_RENDERED[namespaced_page][0] <= if_modified_since.timestamp()
-        ):
-            # We already rendered this page before. If the browser has it in his
-            # cache, he can simply reuse that if we haven't rendered since.
-            response = web.HTTPNotModified()
-        elif (
-            not user and if_none_match is not None and metadata.LAST_TIME_RENDERED[namespaced_page][1] == if_none_match
-        ):
-            # We already rendered this page before. If the browser has it in his
-            # cache, he can simply reuse that if the content is still the same.
+    if can_cache:
+        # These are known without rendering the page; see get_validators().
+        etag, last_modified = metadata.get_validators(namespaced_page)
+        etag = _variant_etag(etag, encoding)
+
+        if _is_not_modified(user, etag, last_modified, if_none_match, if_modified_since):
             response = web.HTTPNotModified()
-        elif (
-            not user
-            and cache_filename
-            and os.path.exists(cache_filename)
-            and os.path.getmtime(cache_filename) >= metadata.LAST_TIME_RENDERED[namespaced_page][0]
-        ):
-            # We already rendered this page to disk. Serve from there.
-            with open(cache_filename) as fp:
-                body = fp.read()
-            response = web.Response(body=body, content_type="text/html", status=status_code)
 
-    # Cache miss; render the page.
-    if response is None:
-        body = _view(wiki_page, user, page)
+    if PRERENDER_WORKERS and can_cache and not user:
+        _request_counts[namespaced_page] += 1
 
-        # Never cache anything in the Folder/.
-        if can_cache:
-            if not user and cache_filename:
-                # Cache the file on disk
-                os.makedirs(os.path.dirname(cache_filename), exist_ok=True)
-                with open(cache_filename, "w") as fp:
-                    fp.write(body)
-
-                page_time = os.path.getmtime(cache_filename)
-            else:
-                # Accuracy of time.time() is higher than getmtime(), so
-                # depending if we cached, use a different clock.
-                page_time = time.time()
+    # Check as we might have this page already on cache.
+    if response is None and can_cache and not user and namespaced_page in metadata.LAST_TIME_RENDERED:
+        # We already rendered this page before. Serve it from memory, or
+        # else from disk.
+        rendered = metadata.RENDERED_PAGES.get(namespaced_page)
+        page_time = metadata.LAST_TIME_RENDERED[namespaced_page]
 
-            # Only update the time if we don't have one yet. This makes sure
-            # that LAST_TIME_RENDERED has the oldest timestamp possible.
-            if namespaced_page not in metadata.LAST_TIME_RENDERED:
-                metadata.LAST_TIME_RENDERED[namespaced_page] = (page_time, None)
+        if rendered is None and CACHE_PAGE_FOLDER:
+            cache_filename = metadata.RENDERED_FILES.get(namespaced_page, page_time)
+            if cache_filename:
+                response = _disk_response(cache_filename, encoding, status_code, page_time)
+
+            if cache_filename and response is None:
+                try:
+                    with open(cache_filename, "rb") as fp:
+                        rendered = RenderedPage(fp.read())
+                except FileNotFoundError:
+                    # Evicted since it was looked up; render it again.
+                    pass
+                else:
+                    metadata.RENDERED_PAGES.set(namespaced_page, rendered)
+
+        if rendered is not None:
+            response = _rendered_response(rendered, encoding, status_code)
 
-            # Update the ETag if we don't have one yet. We only generate ETags for anonymous users.
-            if not user and metadata.LAST_TIME_RENDERED[namespaced_page][1] is None:
-                etag = hashlib.sha256(body.encode("utf-8")).hexdigest()
-                metadata.LAST_TIME_RENDERED[namespaced_page] = (metadata.LAST_TIME_RENDERED[namespaced_page][0], etag)
+    # Serve the page as it was before it got invalidated, with the validators
+    # it had then, while it is rendered again in the background.
+    if response is None and can_cache and not user and metadata.STALE_MAX_AGE:
+        stale = metadata.get_stale_page(namespaced_page)
+        if stale is not None:
+            rendered, etag, last_modified = stale
+            etag = _variant_etag(etag, encoding)
+            if _is_not_modified(user, etag, last_modified, if_none_match, if_modified_since):
+                response = web.HTTPNotModified()
+            else:
+                response = _rendered_response(rendered, encoding, status_code)
 
-                if if_none_match is not None and etag == if_none_match:
-                    # Now we rendered the page, we find out that the etag did match after all.
-                    # Return this information to the client, instead of the payload.
-                    response = web.HTTPNotModified()
+            _stale_count += 1
+            _revalidate(wiki_page, page, namespaced_page)
 
-        if response is None:
+    # Cache miss; render the page.
+    if response is None:
+        # Never cache anything in the Folder/.
+        if not can_cache:
+            body, _ = await _render(wiki_page, user, page)
+        elif user:
+            body, can_cache = await _render_and_cache(wiki_page, user, page, namespaced_page)
+        else:
+            rendered, can_cache = await _render_shared(wiki_page, page, namespaced_page)
+
+        if response is None and rendered is not None:
+            response = _rendered_response(rendered, encoding, status_code)
+        elif response is None:
             response = web.Response(body=body, content_type="text/html", status=status_code)
 
     # Inform the browser under which rules it can cache this page.
     if can_cache:
-        response.last_modified = metadata.LAST_TIME_RENDERED[namespaced_page][0]
+        response.last_modified = last_modified
         if not user:
-            # ETags are weak, as we don't actually know if we are byte-for-byte the same because
-            # of things like gzip compression.
-            response.etag = aiohttp.ETag(metadata.LAST_TIME_RENDERED[namespaced_page][1], is_weak=True)
+            response.etag = aiohttp.ETag(etag)
         response.headers["Vary"] = "Accept-Encoding, Cookie"
         response.headers["Cache-Control"] = "private, must-revalidate, max-age=0"
+
+    if isinstance(response, PageFileResponse):
+        response.page_headers = {
+            header: response.headers[header]
+            for header in ("ETag", "Last-Modified", "Vary")
+            if header in response.headers
+        }
     return response
 
 
+async def load_rendered_pages(not_before):
+    """
+    Reuse the pages rendered to disk by a previous run.
+
+    Only pages rendered after not_before (the last time the metadata
+    changed) by the same generation (see metadata.get_generation()) are used;
+    anything else might not be up to date anymore. If not_before is None,
+    none are; they are only accounted for, so the disk cache stays within
+    its budget.
+
+    Pages are looked up by the pages in the metadata; others, like a
+    category without a page of its own, are rendered again. The disk is
+    scanned in a thread, so requests are served in the meantime.
+    """
+
+    if not CACHE_PAGE_FOLDER:
+        return
+
+    if not metadata.RENDERED_FILES.set_generation(metadata.get_generation()[0]):
+        not_before = None
+
+    loop = asyncio.get_event_loop()
+    pages = await loop.run_in_executor(None, metadata.RENDERED_FILES.scan)
+    metadata.RENDERED_FILES.load(pages)
+    if not_before is None:
+        return
+
+    times = await loop.run_in_executor(None, metadata.RENDERED_FILES.get_times, metadata.INDEX.pages())
+
+    count = 0
+    for namespaced_page, page_time in times.items():
+        # Invalidated (or rendered again) while we were scanning.
+        if namespaced_page in metadata.LAST_TIME_RENDERED:
+            continue
+        if page_time < max(
+            not_before, metadata.LAST_INVALIDATED_ALL, metadata.LAST_INVALIDATED.get(namespaced_page, 0)
+        ):
+            continue
+
+        metadata.LAST_TIME_RENDERED[namespaced_page] = page_time
+        count += 1
+
+    log.info(f"Reusing {count} pages rendered before the restart")
+
+
 @click_helper.extend
 @click.option(
     "--cache-page-folder",
@@ -147,8 +635,59 @@ def view(user, page: str, if_modified_since, if_none_match) -> web.Response:
     default=None,
     show_default=True,
 )
-def click_page(cache_page_folder):
-    global CACHE_PAGE_FOLDER
+@click.option(
+    "--cache-page-folder-size",
+    help="Disk space (in MiB) used to cache rendered pages; 0 for no limit.",
+    default=1024,
+    show_default=True,
+)
+@click.option(
+    "--cache-page-memory",
+    help="Memory (in MiB) used to cache rendered pages, and as much again for their content for logged-in users; "
+    "0 to disable.",
+    default=64,
+    show_default=True,
+)
+@click.option(
+    "--render-workers",
+    help="Amount of threads to render pages in; 0 to render on the event loop.",
+    default=0,
+    show_default=True,
+    type=click.IntRange(min=0),
+)
+@click.option(
+    "--serve-stale-max-age",
+    help="Seconds an invalidated page can still be served as it was, while it is rendered again in the background; "
+    "0 to disable.",
+    default=0,
+    show_default=True,
+    type=click.IntRange(min=0),
+)
+@click.option(
+    "--prerender-workers",
+    help="Amount of pages to render at the same time after they are invalidated, before visitors ask for them; "
+    "0 to disable. This uses CPU time in the background; see --prerender-cpu.",
+    default=0,
+    show_default=True,
+    type=click.IntRange(min=0),
+)
+@click.option(
+    "--prerender-cpu",
+    help="Fraction of time spent on rendering pages before visitors ask for them.",
+    default=0.5,
+    show_default=True,
+    type=click.FloatRange(min=0.01, max=1),
+)
+def click_page(
+    cache_page_folder,
+    cache_page_folder_size,
+    cache_page_memory,
+    render_workers,
+    serve_stale_max_age,
+    prerender_workers,
+    prerender_cpu,
+):
+    global CACHE_PAGE_FOLDER, RENDER_EXECUTOR, RENDER_WORKERS, PRERENDER_WORKERS, PRERENDER_CPU
 
     if cache_page_folder and cache_page_folder.endswith("/"):
         cache_page_folder = cache_page_folder[:-1]
@@ -156,3 +695,17 @@ def click_page(cache_page_folder):
         cache_page_folder = None
 
     CACHE_PAGE_FOLDER = cache_page_folder
+    metadata.RENDERED_FILES.folder = cache_page_folder
+    metadata.RENDERED_FILES.budget = cache_page_folder_size * 1024 * 1024
+    metadata.RENDERED_PAGES.budget = cache_page_memory * 1024 * 1024
+    metadata.RENDERED_FRAGMENTS.budget = cache_page_memory * 1024 * 1024
+
+    RENDER_WORKERS = render_workers
+    if render_workers:
+        RENDER_EXECUTOR = futures.ThreadPoolExecutor(max_workers=render_workers, thread_name_prefix="render")
+        _serialize_expressions()
+
+    metadata.STALE_MAX_AGE = serve_stale_max_age
+
+    PRERENDER_WORKERS = prerender_workers
+    PRERENDER_CPU = prerender_cpu
@@ -8,6 +8,7 @@ from .. import (
     singleton,
     metadata,
 )
+from ..disk_cache import write_atomic
 
 
 def view() -> web.Response:
@@ -21,7 +22,7 @@ def view() -> web.Response:
 
     # Check if we have this file in cache first.
     if cache_filename and os.path.exists(cache_filename):
-        with open(cache_filename) as fp:
+        with open(cache_filename, encoding="utf-8") as fp:
             body = fp.read()
     else:
         body = '<?xml version="1.0" encoding="UTF-8"?>\n'
@@ -30,7 +31,9 @@ def view() -> web.Response:
             'xmlns:xhtml="http://www.w3.org/1999/xhtml">\n'
         )
 
-        for page, page_data in metadata.PAGES.items():
+        for page in sorted(metadata.INDEX.pages()):
+            translations = metadata.INDEX.get_page(page)["translations"]
+
             if page.startswith("Page/"):
                 page = page[len("Page/") :]
             page = urllib.parse.quote(page)
@@ -38,11 +41,11 @@ def view() -> web.Response:
             body += "<url>\n"
             body += f"<loc>{singleton.FRONTEND_URL}/{page}</loc>\n"
 
-            if len(page_data["translations"]) == 1:
-                en_page = page_data["translations"][0]
+            if len(translations) == 1:
+                en_translations = metadata.INDEX.get_referring("translations", translations[0])
 
-                if len(metadata.TRANSLATIONS[en_page]) > 1:
-                    for translation in metadata.TRANSLATIONS[en_page]:
+                if len(en_translations) > 1:
+                    for translation in en_translations:
                         if translation.startswith("Page/"):
                             language = translation.split("/")[1]
                             translation = translation[len("Page/") :]
@@ -64,8 +67,7 @@ def view() -> web.Response:
         if cache_filename:
             # Store in cache for next time it is requested.
             os.makedirs(os.path.dirname(cache_filename), exist_ok=True)
-            with open(cache_filename, "w") as fp:
-                fp.write(body)
+            write_atomic(cache_filename, body.encode())
 
     return web.Response(body=body, content_type="application/xml")
 
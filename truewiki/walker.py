@@ -0,0 +1,59 @@
+import os
+
+
+def walk_pages(root, folder=""):
+    """
+    Walk a folder in storage, yielding every page found in it.
+
+    For every page the path relative to root (without ".mediawiki") and
+    the result of stat() is yielded, in sorted order. This uses the type
+    information os.scandir() already has, so the only syscall per page is
+    the stat() itself. Like glob, hidden files and folders are skipped.
+    """
+
+    path = f"{root}/{folder}" if folder else root
+    prefix = f"{folder}/" if folder else ""
+
+    try:
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+    except (FileNotFoundError, NotADirectoryError):
+        return
+
+    for entry in entries:
+        if entry.name.startswith("."):
+            continue
+
+        if entry.is_dir():
+            yield from walk_pages(root, f"{prefix}{entry.name}")
+            continue
+
+        if not entry.name.endswith(".mediawiki"):
+            continue
+
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            # Removed while we were walking.
+            continue
+
+        yield f"{prefix}{entry.name[: -len('.mediawiki')]}", stat
+
+
+def walk_folders(root, folder):
+    """
+    Yield the name of every folder directly in a folder in storage.
+
+    Like walk_pages(), this uses the type information os.scandir() already
+    has, and hidden folders are skipped.
+    """
+
+    try:
+        with os.scandir(f"{root}/{folder}") as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+    except (FileNotFoundError, NotADirectoryError):
+        return
+
+    for entry in entries:
+        if not entry.name.startswith(".") and entry.is_dir():
+            yield entry.name
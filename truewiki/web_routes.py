@@ -8,6 +8,7 @@ from openttd_helpers import click_helper
 
 from . import (
     config,
+    metadata,
     singleton,
 )
 from .views import (
@@ -29,6 +30,7 @@ log = logging.getLogger(__name__)
 routes = web.RouteTableDef()
 
 RELOAD_SECRET = None
+STATUSZ = False
 
 
 def csp_header(func):
@@ -105,6 +107,7 @@ async def reload(request):
     if data["secret"] != RELOAD_SECRET:
         return web.HTTPNotFound()
 
+    metadata.templates_changed()
     singleton.STORAGE.reload()
 
     return web.HTTPNoContent()
@@ -116,6 +119,33 @@ async def healthz_handler(request):
     return web.HTTPOk()
 
 
+@routes.get("/readyz")
+@csp_header
+async def readyz_handler(request):
+    # Until the metadata is validated against storage, pages might be
+    # served from the caches of a previous run.
+    if not metadata.LOADED.is_set():
+        return web.HTTPServiceUnavailable()
+
+    return web.HTTPOk()
+
+
+@routes.get("/statusz")
+@csp_header
+async def statusz_handler(request):
+    if not STATUSZ:
+        return web.HTTPNotFound()
+
+    return web.json_response(
+        {
+            "page_cache": metadata.RENDERED_PAGES.stats(),
+            "fragment_cache": metadata.RENDERED_FRAGMENTS.stats(),
+            "disk_cache": metadata.RENDERED_FILES.stats(),
+            "render": view_page.render_stats(),
+        }
+    )
+
+
 @routes.get("/License")
 @csp_header
 async def license_page(request):
@@ -242,8 +272,10 @@ async def html_page(request):
     _validate_page(page)
 
     if_modified_since = request.if_modified_since
-    if_none_match = request.if_none_match[0].value if request.if_none_match else None
-    return view_page.view(user, page, if_modified_since, if_none_match)
+    # Weak comparison, as RFC 9110 requires for If-None-Match.
+    if_none_match = tuple(etag.value for etag in request.if_none_match) if request.if_none_match else None
+    accept_encoding = request.headers.get("Accept-Encoding", "")
+    return await view_page.view(user, page, if_modified_since, if_none_match, accept_encoding)
 
 
 @routes.route("*", "/{tail:.*}")
@@ -258,7 +290,13 @@ async def fallback(request):
     "--reload-secret",
     help="Secret to allow an index reload. Always use this via an environment variable!",
 )
-def click_web_routes(reload_secret):
-    global RELOAD_SECRET
+@click.option(
+    "--statusz",
+    help="Expose statistics of the caches and renders on /statusz; only do this if that URL is not public.",
+    is_flag=True,
+)
+def click_web_routes(reload_secret, statusz):
+    global RELOAD_SECRET, STATUSZ
 
     RELOAD_SECRET = reload_secret
+    STATUSZ = statusz
@@ -1,5 +1,12 @@
+import datetime
+import glob
+import hashlib
+import html
+import os
+import urllib
 import wikitextparser
 
+from wikitexthtml.exceptions import InvalidWikiLink
 from wikitexthtml.render import (
     preprocess,
     parameter,
@@ -12,15 +19,289 @@ from . import (
 )
 from .wiki_page import WikiPage
 
+TEMPLATE_FOLDER = "templates"
 
-def wrap_page(page, wrapper, variables, templates):
-    with open(f"templates/{wrapper}.mediawiki", "r") as fp:
-        body = fp.read()
+# Compiled wrapper templates, by name.
+_TEMPLATES = {}
+# Parser functions that only depend on the page.
+_VARIABLES = ("basepagename", "currentyear", "fullpagename", "namespace", "pagename", "subpagename")
 
-    wiki_page = WikiPage(page)
+
+class _Unsupported(Exception):
+    pass
+
+
+class CompiledTemplate:
+    """
+    A wrapper template, compiled into a list of parts.
+
+    The chrome of a page is the same for every page, except for a handful
+    of variables and template slots. So instead of parsing the template as
+    wikitext on every request, it is parsed once. Rendering it is just
+    filling in the variables, picking the branches of every "#if", and
+    joining the result.
+
+    The result is the same as rendering the template as wikitext. For
+    anything where this cannot be guaranteed (an unsupported parser
+    function, or a value that would change how the template is parsed),
+    the template is rendered as wikitext instead.
+    """
+
+    def __init__(self, key, body):
+        self.key = key
+        self.body = body
+        # Parameters used inside a parser function or template.
+        self.nested_parameters = set()
+
+        try:
+            self.parts = self._compile_body(body)
+        except _Unsupported:
+            self.parts = None
+
+    def _compile_body(self, body):
+        # These would be stored as snippet of the page, which needs a page.
+        if "<nowiki>" in body or "<pre>" in body:
+            raise _Unsupported()
+
+        body = preprocess.begin(None, body)
+
+        # After substituting parameters, wikitexthtml rewrites "[[|";
+        # markers are used for template slots.
+        if "[[" in body or "\0" in body:
+            raise _Unsupported()
+
+        return self._compile(body, False)
+
+    def _compile(self, text, nested):
+        wtp = wikitextparser.parse(text)
+        nodes = sorted(wtp.parameters + wtp.parser_functions + wtp.templates, key=lambda node: node.span)
+
+        parts = []
+        pos = 0
+        for node in nodes:
+            start, end = node.span
+            # This node is part of the previous one.
+            if start < pos:
+                continue
+
+            if start > pos:
+                parts.append(text[pos:start])
+            pos = end
+
+            if isinstance(node, wikitextparser.Parameter):
+                if nested:
+                    self.nested_parameters.add(node.name)
+
+                default = node.default
+                if default is not None:
+                    default = self._compile(default, nested)
+                parts.append(("parameter", node.name, default))
+            elif isinstance(node, wikitextparser.ParserFunction):
+                parts.append(self._compile_parser_function(node))
+            else:
+                # Only templates without arguments are used as slots.
+                if node.arguments or "{" in node.name:
+                    raise _Unsupported()
+                parts.append(("template", node.name.strip(), node.string))
+
+        if pos < len(text):
+            parts.append(text[pos:])
+        return parts
+
+    def _compile_parser_function(self, node):
+        name = node.name.lower().strip()
+        arguments = [self._compile(argument.string[1:], True) for argument in node.arguments]
+
+        if name == "#if" and arguments:
+            return ("if", arguments)
+        if name == "urlencode" and len(arguments) == 1:
+            # A template slot would be url-encoded before it is filled in.
+            if any(isinstance(part, tuple) and part[0] == "template" for part in arguments[0]):
+                raise _Unsupported()
+            return ("urlencode", arguments)
+        if name in _VARIABLES and not arguments:
+            return ("variable", name)
+        raise _Unsupported()
+
+    def _can_substitute(self, variables):
+        for name, value in variables.items():
+            # A value could form new wikitext with the template around it.
+            if "{{" in value or "}}" in value or "\0" in value or "[[|" in value:
+                return False
+            if value.startswith("{") or value.endswith(("}", "[")):
+                return False
+
+            # Inside a parser function, it could also change where arguments
+            # start or end.
+            if name in self.nested_parameters and any(c in value for c in "{}[]|"):
+                return False
+        return True
+
+    def render(self, wiki_page, variables, templates):
+        variables = {name: str(value) for name, value in variables.items()}
+
+        if self.parts is None or not self._can_substitute(variables):
+            return _render_wikitext(wiki_page, self.body, variables, templates)
+
+        slots = []
+        body = _render(self.parts, wiki_page, variables, slots)
+        if not slots:
+            return body
+
+        # Fill in the template slots, now all parser functions are done.
+        pieces = body.split("\0")
+        for i in range(1, len(pieces), 2):
+            _, name, string = slots[int(pieces[i])]
+            pieces[i] = templates[name] if name in templates else string
+        return "".join(pieces)
+
+
+def _get_argument(parts, wiki_page, variables, slots):
+    # Same as wikitexthtml does with the argument of a parser function.
+    value = _render(parts, wiki_page, variables, slots)
+    if value.count("\n") <= 1:
+        value = value.strip()
+    return value
+
+
+def _render(parts, wiki_page, variables, slots):
+    result = []
+
+    for part in parts:
+        if isinstance(part, str):
+            result.append(part)
+            continue
+
+        kind = part[0]
+        if kind == "parameter":
+            _, name, default = part
+
+            value = variables.get(name)
+            if value is None:
+                if default is not None:
+                    value = _render(default, wiki_page, variables, slots)
+                else:
+                    value = "{{{" + name + "}}}"
+
+            # Only strip if this was not a multiline value
+            if value.count("\n") < 2:
+                value = value.strip()
+            result.append(value)
+        elif kind == "if":
+            arguments = part[1]
+            if _get_argument(arguments[0], wiki_page, variables, slots).strip():
+                branch = 1
+            else:
+                branch = 2
+
+            if branch < len(arguments):
+                result.append(_get_argument(arguments[branch], wiki_page, variables, slots))
+        elif kind == "urlencode":
+            url = _get_argument(part[1][0], wiki_page, variables, slots).strip()
+            # All variables should already be HTML escaped, so unescape first,
+            # as otherwise we are double encoding them.
+            result.append(urllib.parse.quote(html.unescape(url)))
+        elif kind == "variable":
+            result.append(_render_variable(wiki_page, part[1]))
+        else:
+            # Templates are only filled in after all parser functions are
+            # done; till then a marker takes their place.
+            result.append(f"\0{len(slots)}\0")
+            slots.append(part)
+
+    return "".join(result)
+
+
+def _render_variable(wiki_page, name):
+    if name == "currentyear":
+        return str(datetime.datetime.now().year)
+    if name in ("pagename", "fullpagename", "basepagename"):
+        return html.escape(wiki_page.page)
+    if name == "subpagename":
+        try:
+            return html.escape(wiki_page.clean_title(wiki_page.page))
+        except InvalidWikiLink:
+            return ""
+    return ""
+
+
+def _render_wikitext(wiki_page, body, variables, templates):
     body = preprocess.begin(wiki_page, body)
     wtp = wikitextparser.parse(body)
 
+    arguments = [wikitextparser.Argument(f"|{name}={value}") for name, value in variables.items()]
+    parameter.replace(wiki_page, wtp, arguments)
+
+    parser_function.replace(wiki_page, wtp)
+    for template in reversed(wtp.templates):
+        name = template.name.strip()
+        if name in templates:
+            template.string = templates[name]
+
+    return wtp.string
+
+
+def _compile_template(wrapper):
+    filename = f"{TEMPLATE_FOLDER}/{wrapper}.mediawiki"
+    stat = os.stat(filename)
+    key = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+    template = _TEMPLATES.get(wrapper)
+    if template is None or template.key != key:
+        with open(filename, "r") as fp:
+            template = CompiledTemplate(key, fp.read())
+        _TEMPLATES[wrapper] = template
+
+    return template
+
+
+def get_template(wrapper):
+    """Return the compiled template; changes on disk are only picked up by load_templates()."""
+
+    template = _TEMPLATES.get(wrapper)
+    if template is None:
+        template = _compile_template(wrapper)
+    return template
+
+
+def load_templates():
+    """
+    Compile all wrapper templates that are new or changed on disk since
+    they were last compiled. Returns whether any template changed.
+    """
+
+    templates = dict(_TEMPLATES)
+
+    wrappers = set()
+    for filename in glob.glob(f"{TEMPLATE_FOLDER}/**/*.mediawiki", recursive=True):
+        wrapper = filename[len(TEMPLATE_FOLDER) + 1 : -len(".mediawiki")]
+        wrappers.add(wrapper)
+        _compile_template(wrapper)
+
+    for wrapper in set(_TEMPLATES) - wrappers:
+        del _TEMPLATES[wrapper]
+
+    return _TEMPLATES != templates
+
+
+def get_generation():
+    """
+    Return a digest and the newest modification time of the wrapper
+    templates, as they were last compiled.
+    """
+
+    digest = hashlib.sha256()
+    generation_time = 0
+    for wrapper, template in sorted(_TEMPLATES.items()):
+        digest.update(f"{wrapper}\0{template.key}\0".encode())
+        generation_time = max(generation_time, template.key[1] / 1_000_000_000)
+    return digest.hexdigest(), generation_time
+
+
+def wrap_page(page, wrapper, variables, templates):
+    template = get_template(wrapper)
+    wiki_page = WikiPage(page)
+
     if wrapper != "Error":
         if wiki_page.has_history(page):
             filename = wiki_page.page_ondisk_name(page)
@@ -42,13 +323,4 @@ def wrap_page(page, wrapper, variables, templates):
     variables["license"] = config.LICENSE
     variables["project_name"] = config.PROJECT_NAME
 
-    arguments = [wikitextparser.Argument(f"|{name}={value}") for name, value in variables.items()]
-    parameter.replace(wiki_page, wtp, arguments)
-
-    parser_function.replace(wiki_page, wtp)
-    for template in reversed(wtp.templates):
-        name = template.name.strip()
-        if name in templates:
-            template.string = templates[name]
-
-    return wtp.string
+    return template.render(wiki_page, variables, templates)